@@ -2,7 +2,7 @@ import time
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.ticker import ScalarFormatter
-from modules.pma12 import Pma12,PmaError
+from modules.devices import Pma12,PmaError  # Simulated if OCT_SIMULATE is set
 from modules.signal_processing_hamasaki import calculate_absorbance
 from multiprocessing import Process, Queue
 import modules.data_handler as dh
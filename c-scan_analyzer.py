@@ -2,7 +2,9 @@ import numpy as np
 from modules.signal_processing_hamasaki import SignalProcessorHamasaki as Processor
 import matplotlib.pyplot as plt
 import modules.data_handler as dh
+from modules.checkpoint import VolumeCheckpoint
 import glob
+import os
 
 if __name__=="__main__":
     #calculate conditions
@@ -11,6 +13,8 @@ if __name__=="__main__":
     depth_max=0.3
     n=1.5
     wl_start, wl_end=770, 910
+    workers=os.cpu_count() #number of processes used for calculation
+    dtype=np.float64 #np.float32 halves the size of the calculated volume (deviation below 5e-4 of each A-scan)
 
     #graph setting
     target=0.15 #[mm]
@@ -18,41 +22,75 @@ if __name__=="__main__":
     aspect=1
     mode='xy' #'xd' or 'yd' or 'xy' only
     colormap='gray' #choose from https://matplotlib.org/stable/tutorials/colors/colormaps.html
+    preview=False #If True (mode 'xy' only), only the en-face image at target is calculated from the raw data. Nothing is saved.
 
-    data_prepared=False
-    if glob.glob(filename.strip('.npz')+'_calculated.npz'): 
-        print("Calculated file confirmed.")
-        c_data=np.load(file=filename.strip('.npz')+'_calculated.npz',allow_pickle=True,mmap_mode='r')
-        dh.output_datainfo_calculated(c_data)
-        if  c_data['depth_max'][0]==depth_max \
-        and c_data['resolution'][0]==resolution \
-        and c_data['n'][0]==n:
-            print('Calculation conditions matched.')            
-            data_prepared=True
-        else:
-            print('Calculation condition did not match.')
-
-    if data_prepared is False:
-        data=np.load(file=filename,allow_pickle=True,mmap_mode='r')
+    if preview and mode=='xy':
+        #The transform is evaluated only at the target depth, so the whole C-scan is not reconstructed.
+        #The spectra are read one B-scan at a time, as in the full calculation.
+        data=np.load(file=filename,allow_pickle=True)
         st,ed=Processor.find_index(data['wavelength'],[wl_start,wl_end])
-        sp=Processor(data['wavelength'][st:ed],n,depth_max,resolution)
+        sp=Processor(data['wavelength'][st:ed],n,depth_max,resolution,dtype=dtype)
         dh.output_datainfo(data)
-        result_all=sp.generate_cscan(data['spectra'][:,:,st:ed],data['reference'][st:ed])
-        np.savez_compressed(filename.strip('.npz')+'_calculated.npz',
-        data=result_all,
-        date=data['date'],
-        memo=data['memo'],
-        resolution=np.array([resolution],dtype=int),
-        n=np.array([n],dtype=float),
-        depth_max=np.array([depth_max],dtype=float),
-        depth=sp.depth,
-        width=data['width'],
-        height=data['height']
-        )
-        print('Calculation result saved.')
-        c_data=np.load(filename.strip('.npz')+'_calculated.npz',allow_pickle=True,mmap_mode='r')
-    
-    
+        chunks=(chunk[:,:,st:ed] for chunk in dh.iter_array(filename,'spectra',rows=1))
+        enface=sp.generate_enface_stream(chunks,data['reference'][st:ed],target)
+        c_data={'width':data['width'],'height':data['height']}
+    else:
+        #The calculation result is saved as a memory-mapped volume (.npy) and its conditions (.npz)
+        calculated=filename.strip('.npz')+'_calculated'
+        data_prepared=False
+        if glob.glob(calculated+'.npz'): 
+            print("Calculated file confirmed.")
+            c_data=np.load(file=calculated+'.npz',allow_pickle=True)
+            dh.output_datainfo_calculated(c_data)
+            if  c_data['depth_max'][0]==depth_max \
+            and c_data['resolution'][0]==resolution \
+            and c_data['n'][0]==n \
+            and ('data' in c_data.files or glob.glob(calculated+'.npy')) \
+            and not VolumeCheckpoint.pending(calculated+'.npy'):
+                print('Calculation conditions matched.')            
+                data_prepared=True
+            else:
+                print('Calculation condition did not match.')
+                c_data.close()
+
+        if data_prepared is False:
+            #The conditions file of a previous result is removed, so it never describes the volume being calculated
+            if os.path.exists(calculated+'.npz'):
+                os.remove(calculated+'.npz')
+            #Only the small arrays are loaded. The spectra are read one B-scan at a time.
+            data=np.load(file=filename,allow_pickle=True)
+            st,ed=Processor.find_index(data['wavelength'],[wl_start,wl_end])
+            sp=Processor(data['wavelength'][st:ed],n,depth_max,resolution,dtype=dtype)
+            dh.output_datainfo(data)
+            shape,_=dh.load_array_info(filename,'spectra')
+            #Completed B-scan rows are recorded, so an interrupted calculation is resumed from where it stopped
+            conditions={'filename':filename,'resolution':resolution,'depth_max':depth_max,'n':n,'wavelength_range':[wl_start,wl_end]}
+            checkpoint=VolumeCheckpoint(calculated+'.npy',(shape[0],shape[1],resolution),conditions,dtype=dtype)
+            if checkpoint.completed:
+                print('Resuming calculation. {}/{} rows already calculated.'.format(len(checkpoint.completed),shape[0]))
+            chunks=(chunk[:,:,st:ed] for chunk in dh.iter_array(filename,'spectra',rows=1))
+            sp.generate_cscan_stream(chunks,data['reference'][st:ed],out=checkpoint.volume,workers=workers,
+                                     completed=checkpoint.completed,on_complete=checkpoint.mark)
+            #The conditions are saved before the manifest is deleted, so an interruption here is resumed by the next run
+            np.savez_compressed(calculated+'.npz',
+            date=data['date'],
+            memo=data['memo'],
+            resolution=np.array([resolution],dtype=int),
+            n=np.array([n],dtype=float),
+            depth_max=np.array([depth_max],dtype=float),
+            depth=sp.depth,
+            width=data['width'],
+            height=data['height']
+            )
+            checkpoint.finish()
+            del checkpoint
+            print('Calculation result saved.')
+            c_data=np.load(calculated+'.npz',allow_pickle=True)
+        if 'data' in c_data.files:  #Calculated by the previous version (volume stored in the .npz file)
+            cscan=c_data['data']
+        else:
+            cscan=np.load(calculated+'.npy',mmap_mode='r')
+
     plt.figure()
     plt.rcParams["figure.figsize"] = (6, 6)
     plt.xticks(fontsize=13)
@@ -60,19 +98,22 @@ if __name__=="__main__":
     if mode == 'xd':
         plt.xlabel('Depth [mm]',fontsize=15)
         plt.ylabel('X [mm]',fontsize=15)
-        result=Processor.analyze_cscan(cscan=c_data['data'],target=target,mode=mode,y_max=c_data['width'][0])
+        result=Processor.analyze_cscan(cscan=cscan,target=target,mode=mode,y_max=c_data['width'][0])
         plt.imshow(result,cmap=colormap,extent=[0,depth_max,0,c_data['width'][0]],aspect=aspect,vmax=np.amax(result)*vmax)
 
     elif mode == 'yd':
         plt.xlabel('Depth [mm]',fontsize=15)
         plt.ylabel('Y [mm]',fontsize=15)
-        result=Processor.analyze_cscan(cscan=c_data['data'],target=target,mode=mode,y_max=c_data['height'][0])
+        result=Processor.analyze_cscan(cscan=cscan,target=target,mode=mode,y_max=c_data['height'][0])
         plt.imshow(result,cmap=colormap,extent=[0,depth_max,0,c_data['height'][0]],aspect=aspect,vmax=np.amax(result)*vmax)
 
     elif mode=='xy':
         plt.ylabel('X [mm]',fontsize=15)
         plt.ylabel('Y [mm]',fontsize=15)        
-        result=Processor.analyze_cscan(cscan=c_data['data'],target=target,mode=mode,depth=c_data['depth'])
+        if preview:
+            result=enface
+        else:
+            result=Processor.analyze_cscan(cscan=cscan,target=target,mode=mode,depth=c_data['depth'])
         plt.imshow(result,cmap=colormap,extent=[0,c_data['width'][0],0,c_data['height'][0]],aspect=aspect,vmax=np.amax(result)*vmax)
 
     plt.show()
\ No newline at end of file
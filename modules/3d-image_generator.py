@@ -4,6 +4,7 @@ from tqdm import tqdm
 from mpl_toolkits.mplot3d import Axes3D
 import matplotlib.pyplot as plt
 import copy
+import os
 
 if __name__=="__main__":
     #constants
@@ -14,20 +15,18 @@ if __name__=="__main__":
     st=1664
     ed=2491
     threshold=[0.1, 0.2, 0.4, 0.6, 0.8, 1.0]
+    workers=os.cpu_count() #number of processes used for calculation
 
     #data loading
     data=np.load(filename,allow_pickle=True)
     sp=Processor(data['wavelength'][st:ed],n,depth_max,resolution)
-    result_map=np.zeros((len(data['spectra']),len(data['spectra'][0]),resolution))
     w=np.linspace(0,data['width'][0],(len(data['spectra'][0])))
     h=np.linspace(0,data['height'][0],len(data['spectra']))
     d=sp.depth
     print('<data information>\ndate:{}\nmemo:{}'.format(data['date'][0],data['memo'][0]))
 
     #Signal processing
-    for i in tqdm(range(len(data['spectra']))):
-        for j in range(len(data['spectra'][0])):
-            result_map[i][j]=sp.generate_ascan(data['spectra'][i][j][st:ed], data['reference'][st:ed])
+    result_map=sp.generate_cscan(data['spectra'][:,:,st:ed], data['reference'][st:ed], workers=workers)
 
     #graph configuration
     fig=plt.figure(figsize=(10,10))
@@ -0,0 +1,258 @@
+""" Module for calculating A-scans with the transform that is fastest on the current machine.
+
+`SignalProcessorHamasaki` evaluates the same A-scan with several transforms:
+'dft' (dense sine wave table), 'fused' (resampling folded into the table), 'czt' (zoom FFT), 'fft' (real FFT,
+only if the depth step is an FFT bin) and 'jit' (the 'dft' pipeline compiled with numba, only if it is installed).
+Which one is fastest depends on the number of pixels, the resolution, the number of A-lines per call and the machine. `AscanEngine` measures them once with a short benchmark
+for each typical number of A-lines per call, stores the choices on disk, and uses the one calibrated for the nearest
+number of A-lines unless another backend is specified.
+"""
+import os
+import json
+import time
+import platform
+import tempfile
+import numpy as np
+try:
+    from modules.signal_processing_hamasaki import SignalProcessorHamasaki
+    from modules.table_cache import TableCache
+    from modules import kernels
+except ImportError:  # When executed in the modules directory
+    from signal_processing_hamasaki import SignalProcessorHamasaki
+    from table_cache import TableCache
+    import kernels
+
+
+class AscanEngine:
+    """ Common interface to the transforms of `SignalProcessorHamasaki`.
+    """
+    backends = ('dft', 'fused', 'czt', 'fft', 'jit')  # Available backends
+    calibration_file = os.path.join(TableCache.default_directory, 'ascan_engine.json')  # Where the benchmark results are stored
+
+    def __init__(self, wavelength, n, depth_max, resolution, signal_length=3, depth_min=0, cache=True, dtype=float, backend=None, batch=1):
+        """ Initialization. If `backend` is not specified, the fastest one is selected by `calibrate`.
+
+        Parameters
+        ----------
+        wavelength : `1d-ndarray`, required
+            Wavelength axis[nm] The given spectra must be sampled evenly in wavelength space.
+        n : `float`, required
+            Refractive index of the sample.
+        depth_max : `float`, required
+            maximum value of depth axis[mm]. To make the 'fft' backend available,
+            use `SignalProcessorHamasaki.fft_depth_max`.
+        resolution : `int`, required
+            Resolution of calculation result.
+        signal_length : `float`
+            Signal length. See `SignalProcessorHamasaki`.
+        depth_min : `float`
+            minimum value of depth axis[mm].
+        cache : `bool` or `TableCache`
+            Disk cache of the precomputed tables. See `SignalProcessorHamasaki`.
+        dtype : `numpy.dtype`
+            Precision of the calculation (float64 or float32).
+        backend : `str`
+            Backend used by default ('dft', 'fused', 'czt', 'fft' or 'jit'). If not specified, the result of `calibrate` is used.
+        batch : `int` or `tuple` of `int`
+            Typical numbers of A-lines per call (e.g. (1, step_h) for the live view and the B-scans).
+            A backend is calibrated for each of them, and each call uses the one calibrated for the nearest number of A-lines.
+        """
+        if backend is not None and backend not in AscanEngine.backends:
+            raise ValueError("backend must be one of {}.".format(AscanEngine.backends))
+        self.__args = (wavelength, n, depth_max, resolution)
+        self.__kwargs = {'signal_length': signal_length, 'cache': cache, 'depth_min': depth_min, 'dtype': dtype}
+        self.__processors = {}
+        self.__choices = {}  # {number of A-lines per call: backend}
+        self.__ref = None
+        self.backend = backend
+        if backend is None:
+            batches = [int(b) for b in np.atleast_1d(batch)]
+            for b in batches:
+                self.calibrate(b)
+            self.backend = self.__choices[batches[0]]
+
+    @property
+    def depth(self):
+        """ Horizontal axis after the transform (depth [mm])
+        """
+        return self.processor().depth
+
+    def select(self, lines):
+        """ Backend used for `lines` A-lines per call.
+
+        Parameter
+        ----------
+        lines : `int`, required
+            Number of A-lines per call.
+
+        Return
+        ----------
+        backend : `str`
+            Backend calibrated for the nearest number of A-lines (in ratio), or `backend` if it was specified.
+        """
+        if not self.__choices:
+            return self.backend
+        batch = min(self.__choices, key=lambda b: abs(np.log(b/max(lines, 1))))
+        return self.__choices[batch]
+
+    def processor(self, backend=None):
+        """ Processor of the backend (created on first use).
+
+        Parameter
+        ----------
+        backend : `str`
+            Backend. If not specified, `backend` (the one selected for the first batch).
+
+        Return
+        ----------
+        `SignalProcessorHamasaki`
+            Processor with the reference spectra set (if it has been given).
+        """
+        backend = self.backend if backend is None else backend
+        if backend not in self.__processors:
+            if backend not in AscanEngine.backends:
+                raise ValueError("backend must be one of {}.".format(AscanEngine.backends))
+            transform = 'dft' if backend in ('fused', 'jit') else backend
+            processor = SignalProcessorHamasaki(*self.__args, transform=transform, fused=backend == 'fused', jit=backend == 'jit', **self.__kwargs)
+            if self.__ref is not None:
+                processor.set_reference(self.__ref)
+            self.__processors[backend] = processor
+        return self.__processors[backend]
+
+    def set_reference(self, reference):
+        """ Specify the reference spectra for all backends.
+
+        Parameter
+        ----------
+        reference : `1d-ndarray`, required
+            Spectra of reference light only, sampled evenly in wavelength space.
+        """
+        self.__ref = np.asarray(reference)
+        for processor in self.__processors.values():
+            processor.set_reference(self.__ref)
+
+    def __prepare(self, interference, reference, backend):
+        if self.__ref is None:
+            if reference is None:
+                raise ValueError("Reference data is not set.")
+            self.set_reference(reference)
+        if backend is None:
+            backend = self.select(int(np.prod(np.shape(interference)[:-1])))
+        return self.processor(backend)
+
+    def generate_ascan(self, interference, reference, backend=None):
+        """ Same as `SignalProcessorHamasaki.generate_ascan`, calculated with the backend selected for the number of A-lines
+        (or the specified one).
+        """
+        return self.__prepare(interference, reference, backend).generate_ascan(interference, None)
+
+    def generate_bscan(self, interference, reference, backend=None, **kwargs):
+        """ Same as `SignalProcessorHamasaki.generate_bscan`, calculated with the backend selected for the number of A-lines
+        (or the specified one).
+        """
+        return self.__prepare(interference, reference, backend).generate_bscan(interference, None, **kwargs)
+
+    def generate_cscan(self, interference, reference, backend=None, **kwargs):
+        """ Same as `SignalProcessorHamasaki.generate_cscan`, calculated with the backend selected for the number of A-lines
+        (or the specified one).
+        """
+        return self.__prepare(interference, reference, backend).generate_cscan(interference, None, **kwargs)
+
+    def __calibration_key(self, batch):
+        wavelength, n, depth_max, resolution = self.__args
+        return '{}|{}|pixels={}|resolution={}|batch={}|signal_length={}|dtype={}|fft={}|jit={}'.format(
+            platform.node(), os.cpu_count(), len(wavelength), int(resolution), int(batch),
+            float(self.__kwargs['signal_length']), np.dtype(self.__kwargs['dtype']).str, self.__fft_available(), kernels.available)
+
+    def __fft_available(self):
+        """ Whether the depth step is an FFT bin (see `SignalProcessorHamasaki.fft_depth_max`), without building the tables.
+        """
+        wavelength, n, depth_max, resolution = self.__args
+        depth_min = self.__kwargs['depth_min']
+        if int(resolution) < 2:
+            return False
+        step = SignalProcessorHamasaki.fft_depth_max(wavelength, n, resolution, self.__kwargs['signal_length'])/(int(resolution)-1)
+        first = depth_min/step
+        return bool(np.isclose(depth_max-depth_min, step*(int(resolution)-1), rtol=1e-9, atol=0) and abs(first-round(first)) < 1e-6)
+
+    def calibrate(self, batch=1, repeats=3, force=False):
+        """ Selects the fastest backend for `batch` A-lines per call on this machine.
+        The result is stored in `calibration_file` and reused for the same conditions unless `force` is True.
+        The processors of the other backends are released after the benchmark.
+
+        Parameters
+        ----------
+        batch : `int`
+            Number of A-lines per call.
+        repeats : `int`
+            Number of measurements per backend (the fastest one is used).
+        force : `bool`
+            If True, the benchmark is run even if a stored result exists.
+
+        Return
+        ----------
+        backend : `str`
+            Fastest backend.
+        """
+        key = self.__calibration_key(batch)
+        results = self.__read_calibration()
+        if key in results and not force:
+            self.__choices[int(batch)] = results[key]['backend']
+            return results[key]['backend']
+        rng = np.random.default_rng(0)
+        pixels = len(self.__args[0])
+        reference = 1+rng.random(pixels)
+        spectra = reference*(1+0.1*rng.standard_normal((int(batch), pixels)))
+        times = {}
+        for backend in AscanEngine.backends:
+            if backend == 'jit' and not kernels.available:  # Same as 'dft' without numba
+                continue
+            if backend == 'fft' and not self.__fft_available():
+                continue
+            try:
+                processor = self.processor(backend)
+            except ValueError:  # e.g. 'fft' with an incompatible depth axis
+                continue
+            processor.set_reference(reference)
+            processor.generate_ascan(spectra, None)  # Warm-up
+            elapsed = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                processor.generate_ascan(spectra, None)
+                elapsed.append(time.perf_counter()-start)
+            times[backend] = min(elapsed)
+            if self.__ref is not None:
+                processor.set_reference(self.__ref)
+        best = min(times, key=times.get)
+        print('A-scan engine calibrated ({} lines): {} [{}]'.format(
+            batch, best, ', '.join('{}={:.2e}s'.format(k, v) for k, v in times.items())))
+        results[key] = {'backend': best, 'times': times}
+        self.__write_calibration(results)
+        self.__choices[int(batch)] = best
+        used = set(self.__choices.values()) | {self.backend}
+        for backend in list(self.__processors):
+            if backend not in used:  # The dense tables take tens of MB each
+                del self.__processors[backend]
+        return best
+
+    def __read_calibration(self):
+        try:
+            with open(AscanEngine.calibration_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def __write_calibration(self, results):
+        """ Failure to write (e.g. read-only directory) is not an error; the benchmark is simply run again next time.
+        """
+        tmp = None
+        try:
+            directory = os.path.dirname(os.path.abspath(AscanEngine.calibration_file))
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=directory)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(results, f, indent=1)
+            os.replace(tmp, AscanEngine.calibration_file)
+        except OSError:
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
@@ -0,0 +1,448 @@
+""" Module for controlling the serial stage controllers (CRUX, FINE-01r, NCM6212C) from an asyncio event loop.
+
+The drivers in `crux`, `fine01r` and `ncm6212c` block the calling thread until the reply arrives or the port
+times out. Here, every port is served by its own worker thread (`SerialTransport`): the coroutines wait for
+the reply without blocking the event loop, the commands to one port are executed in order, and every command
+has a timeout. After a timeout, the late reply is discarded before the next command is written.
+Moves are issued without waiting for the completion on the controller, and the completion is awaited by polling
+the position, so the stage can be controlled concurrently with the readout of the spectrometers and the display
+(e.g. with `loop.run_in_executor(None, ccs.read_spectra)`).
+
+Commands whose replies can be matched to them by order can be pipelined with `SerialTransport.query_many`:
+all commands are written at once and the replies are read afterwards. This is only used where the controller
+queues the commands (NCM6212C, with hardware flow control), or when explicitly enabled.
+"""
+import asyncio
+import concurrent.futures
+import serial
+try:
+    from modules.crux import Crux, CruxError
+    from modules.fine01r import Fine01rError
+    from modules.ncm6212c import Ncm6212cError
+except ImportError:  # When executed in the modules directory
+    from crux import Crux, CruxError
+    from fine01r import Fine01rError
+    from ncm6212c import Ncm6212cError
+
+
+class SerialTransport:
+    """ Serial port served by a dedicated worker thread.
+    """
+
+    def __init__(self, port, terminator=b'\r\n', timeout=1.):
+        """ Initialization.
+
+        Parameters
+        ----------
+        port : `serial.Serial`, required
+            Opened serial port (or any object with `write`, `read_until`, `reset_input_buffer`, `timeout` and `close`).
+        terminator : `bytes`
+            End of a reply.
+        timeout : `float`
+            Default timeout of a command [sec].
+        """
+        self.port = port
+        self.terminator = terminator
+        self.timeout = timeout
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)  # Keeps the order of the commands
+        self.__lost = False  # A command timed out, so its reply may still arrive
+
+    def __exchange(self, commands, replies, timeout):
+        """ Writes the commands and reads `replies` replies (runs in the worker thread).
+        """
+        if self.__lost:  # Discards the late replies of the command that timed out
+            self.port.reset_input_buffer()
+            self.__lost = False
+        self.port.timeout = timeout
+        for command in commands:
+            self.port.write(command)
+        result = []
+        for _ in range(replies):
+            reply = self.port.read_until(self.terminator)
+            if not reply.endswith(self.terminator):
+                self.__lost = True
+                raise TimeoutError("No reply within {} sec.".format(timeout))
+            result.append(reply.decode('utf-8').strip())
+        return result
+
+    async def __run(self, commands, replies, timeout):
+        timeout = self.timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.__executor, self.__exchange, commands, replies, timeout)
+        # The port timeout applies to each reply. The outer one only guards against a stalled write.
+        try:
+            return await asyncio.wait_for(future, timeout*(replies+1)+1.)
+        except asyncio.TimeoutError:  # Not the built-in TimeoutError before Python 3.11
+            self.__lost = True
+            raise TimeoutError("No reply within {} sec.".format(timeout)) from None
+
+    async def send(self, command, timeout=None):
+        """ Writes a command that has no reply.
+
+        Parameters
+        ----------
+        command : `bytes`, required
+            Formatted command.
+        timeout : `float`
+            Timeout [sec]. If not specified, the default one.
+        """
+        await self.__run([command], 0, timeout)
+
+    async def query(self, command, timeout=None):
+        """ Writes a command and returns the reply.
+
+        Parameters
+        ----------
+        command : `bytes`, required
+            Formatted command.
+        timeout : `float`
+            Timeout [sec]. If not specified, the default one.
+
+        Returns
+        -------
+        `str`
+            Reply without the terminator.
+
+        Raise
+        -------
+        TimeoutError :
+            When the reply does not arrive within the timeout.
+        """
+        return (await self.__run([command], 1, timeout))[0]
+
+    async def query_many(self, commands, timeout=None):
+        """ Writes all commands at once and returns their replies in the same order (pipelining).
+        Use it only if the controller queues the commands and replies to each one.
+
+        Parameters
+        ----------
+        commands : `list` of `bytes`, required
+            Formatted commands.
+        timeout : `float`
+            Timeout of each reply [sec]. If not specified, the default one.
+
+        Returns
+        -------
+        `list` of `str`
+            Replies.
+        """
+        return await self.__run(list(commands), len(commands), timeout)
+
+    def close(self):
+        """ Stops the worker thread and closes the port.
+        """
+        self.__executor.shutdown(wait=True)
+        self.port.close()
+
+
+def open_port(port, baudrate, **kwargs):
+    """ Opens a serial port (pyserial).
+    """
+    return serial.Serial(port=port, baudrate=baudrate, **kwargs)
+
+
+class AsyncCrux:
+    """ Class to control the auto stage (CRUX) from an asyncio event loop.
+    """
+
+    def __init__(self, transport, pipelining=False):
+        """ Initialization. Use `AsyncCrux.open` to connect to the device.
+
+        Parameters
+        ----------
+        transport : `SerialTransport`, required
+            Transport of the port (terminator b'\\n').
+        pipelining : `bool`
+            Whether commands are pipelined (e.g. the positions of both axes in `read_positions`).
+        """
+        self.transport = transport
+        self.pipelining = pipelining
+
+    @classmethod
+    async def open(cls, port, baudrate=9600, timeout=1., pipelining=False):
+        """ Connects to the device and checks it.
+
+        Parameters
+        ----------
+        port : `str`, required
+            Serial port identifier.
+        baudrate : `int`
+            Baud rate.
+        timeout : `float`
+            Default timeout of a command [sec].
+        pipelining : `bool`
+            See `AsyncCrux`.
+
+        Raise
+        ---------
+        CruxError :
+            When the connection fails.
+        """
+        try:
+            transport = SerialTransport(open_port(port, baudrate), terminator=b'\n', timeout=timeout)
+        except serial.serialutil.SerialException:
+            raise CruxError(msg="CRUX not found.")
+        self = cls(transport, pipelining)
+        info = await self.command('IDN', check=False)
+        if len(info) < 3 or info[0] != 'C' or info[2] != 'CRUX':
+            raise CruxError(msg="*IDN? query failed.\n")
+        return self
+
+    @staticmethod
+    def __check(responce):
+        if responce[0] == 'E':
+            raise CruxError(msg='Error returned from device. See error code and manual(pp.60-61) for details.\nError Code:'+str(responce)+'\n')
+        return responce
+
+    async def command(self, cmd, param=[], timeout=None, check=True):
+        """ Sends a command and returns the reply (split by whitespace).
+
+        Raise
+        ---------
+        CruxError :
+            When the device returns an error or does not reply within the timeout.
+        """
+        try:
+            responce = (await self.transport.query(Crux.format_cmd(cmd, param), timeout)).split()
+        except TimeoutError:
+            raise CruxError(msg='No reply from CRUX.(command:{})'.format(cmd))
+        return AsyncCrux.__check(responce) if check else responce
+
+    async def read_position(self, axis_num):
+        """ Reads the current position [pulse] of an axis (1: horizontal, 2: vertical).
+        """
+        return int((await self.command('RDP', [axis_num]))[2])
+
+    async def read_positions(self):
+        """ Reads the positions [pulse] of both axes.
+
+        Returns
+        -------
+        `tuple`
+            (horizontal, vertical)
+        """
+        if not self.pipelining:
+            return await self.read_position(1), await self.read_position(2)
+        try:
+            replies = await self.transport.query_many([Crux.format_cmd('RDP', [1]), Crux.format_cmd('RDP', [2])])
+        except TimeoutError:
+            raise CruxError(msg='No reply from CRUX.(command:RDP)')
+        return tuple(int(AsyncCrux.__check(r.split())[2]) for r in replies)
+
+    async def wait_position(self, position, axis_num=1, interval=0.005, timeout=10.):
+        """ Waits until the stage reaches the target position [pulse].
+
+        Raise
+        ---------
+        CruxError :
+            When the stage does not reach the target position within the timeout.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()+timeout
+        while True:
+            current = await self.read_position(axis_num)
+            if current == position:
+                return
+            if loop.time() > deadline:
+                raise CruxError(msg='Stage did not reach the target position.(axis:{}, target:{}, current:{})'.format(axis_num, position, current))
+            await asyncio.sleep(interval)
+
+    async def absolute_move(self, position, axis_num=1, velocity=9, wait=True, timeout=10.):
+        """ Moves an axis to the absolute position [pulse].
+        The command returns immediately (ret_form=1). If `wait`, the completion is awaited by polling the position.
+        """
+        await self.command('APS', [axis_num, velocity, position, 1])
+        if wait:
+            await self.wait_position(position, axis_num, timeout=timeout)
+
+    async def relative_move(self, distance, axis_num=1, velocity=9, wait=True, timeout=10.):
+        """ Moves an axis by `distance` [pulse].
+        """
+        target = await self.read_position(axis_num)+distance
+        await self.command('RPS', [axis_num, velocity, distance, 1])
+        if wait:
+            await self.wait_position(target, axis_num, timeout=timeout)
+
+    async def biaxial_move(self, v, h, velocity=9, wait=True, timeout=10.):
+        """ Moves both axes to the absolute positions [pulse] together.
+        """
+        await self.command('MPI', [1, 0, velocity])
+        await self.command('MPI', [2, 0, velocity])
+        await self.command('MPS', [1, h, 2, v, 1])
+        if wait:
+            await asyncio.gather(self.wait_position(h, 1, timeout=timeout), self.wait_position(v, 2, timeout=timeout))
+
+    async def move_origin(self, axis_num=0, velocity=9, timeout=60.):
+        """ Returns the stage to its origin (0 : both axes). The reply arrives when the operation is complete.
+        """
+        for axis in ((1, 2) if axis_num == 0 else (axis_num,)):
+            await self.command('ORG', [axis, velocity, 0], timeout=timeout)
+
+    async def stop(self, axis_num=1, stop_mode=0):
+        """ Stops the stage (0 : deceleration stop, 1 : emergency stop).
+        """
+        await self.command('STP', [axis_num, stop_mode])
+
+    async def close(self):
+        """ Returns the stage to its origin and closes the port.
+        """
+        await self.move_origin()
+        self.transport.close()
+
+
+class AsyncFine01r:
+    """ Class to control the piezo stage (FINE-01r) from an asyncio event loop.
+    """
+
+    def __init__(self, transport):
+        """ Initialization. Use `AsyncFine01r.open` to connect to the device.
+        """
+        self.transport = transport
+
+    @classmethod
+    async def open(cls, port, baudrate=38400, timeout=0.5):
+        """ Connects to the device and checks it.
+
+        Raise
+        ---------
+        Fine01rError :
+            When the connection fails.
+        """
+        try:
+            transport = SerialTransport(open_port(port, baudrate), timeout=timeout)
+        except serial.serialutil.SerialException:
+            raise Fine01rError(msg="FINE01R not found.")
+        await asyncio.sleep(2)  # The controller restarts when the port is opened
+        self = cls(transport)
+        if await self.sendreceive('?:N') != 'FINE-01r':
+            raise Fine01rError(msg="FINE01R not found.")
+        return self
+
+    async def sendreceive(self, cmd, timeout=None):
+        """ Sends a command and returns the reply.
+
+        Raise
+        ---------
+        Fine01rError :
+            When the device does not reply within the timeout.
+        """
+        try:
+            return await self.transport.query((cmd+'\r\n').encode('utf-8'), timeout)
+        except TimeoutError:
+            raise Fine01rError(msg='No reply from FINE01R.(command:{})'.format(cmd))
+
+    async def status(self):
+        """ Operating status of the stage (same keys as `Fine01r.status`).
+        """
+        stat = (await self.sendreceive('Q:')).split(',')
+        return {'position': int(stat[0]), 'cmd_success': stat[1] == 'K', 'Stop': stat[2] == 'K', 'cmd_permission': stat[3] == 'R'}
+
+    async def absolute_move(self, position, wait=True, interval=0.01, timeout=5.):
+        """ Moves the stage to the absolute position. If `wait`, the stop of the stage is awaited.
+        """
+        if position == 0:
+            reply = await self.sendreceive('H:1')
+        else:
+            await self.sendreceive('A:1+P{}'.format(position))
+            reply = await self.sendreceive('G:')
+        if wait:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time()+timeout
+            while not (await self.status())['Stop']:
+                if loop.time() > deadline:
+                    raise Fine01rError(msg='Stage did not stop.')
+                await asyncio.sleep(interval)
+        return reply
+
+    async def stop(self):
+        """ Stops the stage and returns it to the home (0mV) position.
+        """
+        return await self.sendreceive('L:E')
+
+    async def close(self):
+        """ Returns the stage to the home position and closes the port.
+        """
+        await self.absolute_move(0, wait=False)
+        self.transport.close()
+
+
+class AsyncNcm6212c:
+    """ Class to control the 2-axis piezo stage (NCM6212C) from an asyncio event loop.
+    The controller uses hardware flow control, so its queries are pipelined.
+    """
+
+    def __init__(self, transport):
+        """ Initialization. Use `AsyncNcm6212c.open` to connect to the device.
+        """
+        self.transport = transport
+
+    @classmethod
+    async def open(cls, port, baudrate=38400, timeout=0.5):
+        """ Connects to the device, checks it and sets the servo mode to CLOSED.
+
+        Raise
+        ---------
+        Ncm6212cError :
+            When the connection fails.
+        """
+        try:
+            transport = SerialTransport(open_port(port, baudrate, rtscts=True), timeout=timeout)
+        except serial.serialutil.SerialException:
+            raise Ncm6212cError(msg="NCM6212C not found.")
+        await asyncio.sleep(2)
+        self = cls(transport)
+        if (await self.query('VR?'))[0] != 'NC1000SR 150801  03-11':
+            raise Ncm6212cError(msg="NCM6212C not found.")
+        await self.set_servo_mode(1)
+        return self
+
+    async def query(self, *cmds, timeout=None):
+        """ Sends the commands at once and returns their replies.
+
+        Raise
+        ---------
+        Ncm6212cError :
+            When the device does not reply within the timeout.
+        """
+        try:
+            return await self.transport.query_many([(cmd+'\r\n').encode('utf-8') for cmd in cmds], timeout)
+        except TimeoutError:
+            raise Ncm6212cError(msg='No reply from NCM6212C.(command:{})'.format(', '.join(cmds)))
+
+    async def status(self):
+        """ Positions and errors of both axes (same keys as `Ncm6212c.status`).
+        """
+        a, b, error_a, error_b = await self.query('PS? A', 'PS? B', 'ER? A', 'ER? B')
+        return {'position-A': int(a), 'position-B': int(b), 'error-A': error_a, 'error-B': error_b}
+
+    async def absolute_move(self, axis, position):
+        """ Moves an axis ('A' or 'B') to the absolute position [nm] and returns the instruction position.
+        """
+        await self.transport.send('MV {}{}\r\n'.format(axis, position).encode('utf-8'))
+        return (await self.query('MV? {}'.format(axis)))[0]
+
+    async def set_servo_mode(self, mode):
+        """ Sets the servo mode of both axes. 0:OPEN, 1:CLOSED, 2:STAND-BY.
+        """
+        await self.transport.send('SV A{}\r\nSV B{}\r\n'.format(mode, mode).encode('utf-8'))
+
+    async def close(self):
+        """ Returns both axes to 0 and closes the port.
+        """
+        await self.absolute_move('A', 0)
+        await self.absolute_move('B', 0)
+        self.transport.close()
+
+
+if __name__ == "__main__":
+    async def main():
+        stage = await AsyncCrux.open('COM6')
+        # The stage moves while the positions are printed
+        move = asyncio.create_task(stage.biaxial_move(v=2000, h=2000))
+        while not move.done():
+            print('Stage position:x={}, z={}[pulse]'.format(*await stage.read_positions()))
+            await asyncio.sleep(0.1)
+        await move
+        await stage.close()
+
+    asyncio.run(main())
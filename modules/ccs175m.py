@@ -50,6 +50,8 @@ class Ccs175m():
     __dev.tlccs_SetIntegrationTime.argtypes = (ctypes.c_long, ctypes.c_double)
     __dev.GetWavelengthDataArray.argtype = (ctypes.c_long)
     __dev.GetScanDataArray.argtype = (ctypes.c_long)
+    __dev.tlccs_getScanData.argtypes = (ctypes.c_long, np.ctypeslib.ndpointer(dtype=np.double, ndim=1, shape=(num_pixels,), flags=('C_CONTIGUOUS', 'WRITEABLE')))
+    __dev.tlccs_getDeviceStatus.argtypes = (ctypes.c_long, ctypes.POINTER(ctypes.c_int32))
     __dev.tlccs_Close.argtype = (ctypes.c_long)
     __dev.OutputErrorMessage.argtypes = (ctypes.c_long, ctypes.c_long)
 
@@ -57,6 +59,11 @@ class Ccs175m():
     __dev.tlccs_Init.restype = (ctypes.c_long)
     __dev.GetScanDataArray.restype = np.ctypeslib.ndpointer(dtype=np.double, shape=num_pixels)
     __dev.GetWavelengthDataArray.restype = np.ctypeslib.ndpointer(dtype=np.double, shape=num_pixels)
+    __dev.tlccs_getScanData.restype = (ctypes.c_long)
+    __dev.tlccs_getDeviceStatus.restype = (ctypes.c_long)
+
+    status_scan_transfer = 0x0010 #device status bit: a scan is waiting to be transferred
+    poll_interval = (1.0e-4, 1.0e-3) #bounds of the interval [sec] at which the device status is polled while waiting for a scan
     
     def __init__(self,name:str):
         """Initiates and unlock communication with the device
@@ -83,6 +90,14 @@ class Ccs175m():
 
         #get wavelength data
         self.__wavelength = Ccs175m.__dev.GetWavelengthDataArray(Ccs175m.__handle)
+
+        #buffers of the streaming readout (reused, so no memory is allocated per frame)
+        self.__block = np.zeros((1, Ccs175m.num_pixels))
+        self.__status = ctypes.c_int32()
+        self.__status_ref = ctypes.byref(self.__status)
+        self.__interval = Ccs175m.poll_interval[1] #polling interval [sec] (a tenth of the integration time)
+        self.frame_count = 0 #number of frames read out since the connection
+        self.timestamp = None #time (time.perf_counter) at which the last frame was read out
         print('CCS175M is ready.')
 
     @property
@@ -109,6 +124,7 @@ class Ccs175m():
         Ccs175m.__err = Ccs175m.__dev.tlccs_SetIntegrationTime(Ccs175m.__handle.value, self.iTime)
         if Ccs175m.__err:
             raise CcsError(status_code=Ccs175m.__err, session=Ccs175m.__handle)
+        self.__interval = min(max(time/10, Ccs175m.poll_interval[0]), Ccs175m.poll_interval[1])
     
     def start_scan(self):
         """This function starts measurement continuously.
@@ -123,30 +139,76 @@ class Ccs175m():
         if Ccs175m.__err:
             raise CcsError(status_code=Ccs175m.__err, session=Ccs175m.__handle)
     
-    def read_spectra(self,averaging:int=1):
+    def __get_scan_data(self, out):
+        """Waits for the next scan and writes it into `out` (1d, float64, C-contiguous).
+        The device status is polled every tenth of the integration time (0.1 to 1 ms), so the waiting thread
+        sleeps most of the time instead of holding the GIL, and the frame is timestamped within that interval.
+        """
+        while True:
+            Ccs175m.__err = Ccs175m.__dev.tlccs_getDeviceStatus(Ccs175m.__handle, self.__status_ref)
+            if Ccs175m.__err:
+                raise CcsError(status_code=Ccs175m.__err, session=Ccs175m.__handle)
+            if self.__status.value & Ccs175m.status_scan_transfer:
+                break
+            time.sleep(self.__interval)
+        Ccs175m.__err = Ccs175m.__dev.tlccs_getScanData(Ccs175m.__handle, out)
+        if Ccs175m.__err:
+            raise CcsError(status_code=Ccs175m.__err, session=Ccs175m.__handle)
+        self.frame_count += 1
+        self.timestamp = time.perf_counter()
+
+    def read_frame(self,out):
+        """This function reads out one frame directly into a caller-supplied buffer (no memory is allocated).
+        Be sure to call 'start_scan' function before this function.
+
+        Parameters
+        ----------
+        out : `1d-ndarray`, required
+            Where the frame is written. float64, C-contiguous and `num_pixels` long (e.g. a row of a ring buffer).
+
+        Return
+        ---------
+        `float`
+            Time (time.perf_counter) at which the frame was read out.
+
+        Raise
+        ---------
+        CcsError :
+            When the frame is saturated.
+        """
+        self.__get_scan_data(out)
+        if out.max() >= 1:
+            raise CcsError(status_code=None, session=None, msg="CcsError:Measured data are saturated.")
+        return self.timestamp
+
+    def read_spectra(self,averaging:int=1,out=None):
         """This function reads out spectra.
         Be sure to call 'start_scan' function before this function.
+        The frames are written into a preallocated block and averaged in place,
+        and the saturation is checked once for the whole block.
 
         Parameters
         ----------
         averaging : `int`
             The number of measurement repetitions. 2 or more, the data is an average value.
+        out : `1d-ndarray`
+            Where the spectra are written. If not specified, a new array is returned.
 
         Return
         ---------
         `1d-ndarray`
             Spectra sampled evenly in the wavelength space.
-            In case of size_reduction=True, the returned data type is float32.
         """
-        data = np.zeros_like(self.wavelength)
-            
+        if len(self.__block) < averaging:
+            self.__block = np.zeros((averaging, Ccs175m.num_pixels)) #grows only when averaging increases
+        block = self.__block[:averaging]
         for i in range(averaging):
-            data2 = Ccs175m.__dev.GetScanDataArray(Ccs175m.__handle)
-            if np.amax(data2) >= 1:
-                raise CcsError(status_code=None, session=None, msg="CcsError:Measured data are saturated.")
-            data += data2    
-
-        return data / averaging
+            self.__get_scan_data(block[i])
+        if block.max() >= 1:
+            raise CcsError(status_code=None, session=None, msg="CcsError:Measured data are saturated.")
+        if out is None:
+            out = np.empty(Ccs175m.num_pixels)
+        return np.mean(block, axis=0, out=out)
 
     def close_ccs(self):
         """ Release the instrument and device driver
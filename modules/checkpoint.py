@@ -0,0 +1,109 @@
+""" Module for resumable processing of large volumes.
+
+The result is written to a memory-mapped .npy file, and the rows (axis0) that have been completed are
+recorded in a manifest (.json) next to it. If the processing is interrupted, a rerun with the same
+conditions finds the manifest and only the missing rows have to be processed.
+"""
+import os
+import json
+import tempfile
+import numpy as np
+try:
+    from modules.data_handler import create_volume
+except ImportError:  # When executed in the modules directory
+    from data_handler import create_volume
+
+
+class VolumeCheckpoint:
+    """ Result volume (.npy) with a progress manifest.
+    """
+
+    def __init__(self, file_path, shape, conditions, dtype=float):
+        """ Opens the volume. If a manifest with the same conditions exists, the processing is resumed.
+        Otherwise a new volume is created.
+
+        Parameters
+        ----------
+        file_path : `str`, required
+            Where the volume is stored (.npy). The manifest is stored as `<file_path without extension>_progress.json`.
+        shape : `tuple`, required
+            Shape of the volume. Progress is recorded in units of axis0 (e.g. B-scan rows of a C-scan).
+        conditions : `dict`, required
+            Calculation conditions (JSON serializable). The processing is resumed only if they match exactly.
+        dtype : `numpy.dtype`
+            Data type of the volume.
+        """
+        self.__path = file_path
+        self.__manifest_path = VolumeCheckpoint.manifest_path(file_path)
+        self.__manifest = {'conditions': conditions, 'shape': list(shape), 'dtype': np.dtype(dtype).str, 'completed': []}
+        previous = self.__read_manifest()
+        if previous is not None and os.path.exists(file_path) \
+        and all(previous.get(k) == self.__manifest[k] for k in ('conditions', 'shape', 'dtype')):
+            self.__manifest['completed'] = previous['completed']
+            self.volume = np.load(file_path, mmap_mode='r+')
+        else:
+            self.volume = create_volume(file_path, shape, dtype)
+            self.__write_manifest()
+        self.completed = set(self.__manifest['completed'])
+
+    @staticmethod
+    def manifest_path(file_path):
+        """ Path of the manifest corresponding to the volume.
+        """
+        return os.path.splitext(file_path)[0]+'_progress.json'
+
+    @staticmethod
+    def pending(file_path):
+        """ Whether the processing of the volume has been started but not finished.
+        """
+        return os.path.exists(VolumeCheckpoint.manifest_path(file_path))
+
+    @property
+    def is_complete(self):
+        """ Whether all rows have been completed.
+        """
+        return len(self.completed) == self.volume.shape[0]
+
+    def __read_manifest(self):
+        try:
+            with open(self.__manifest_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def __write_manifest(self):
+        directory = os.path.dirname(os.path.abspath(self.__manifest_path))
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.__manifest, f)
+        os.replace(tmp, self.__manifest_path)  # Atomic, so the manifest is never half-written
+
+    def mark(self, start, stop):
+        """ Records that rows [start, stop) have been written to the volume.
+        The volume is flushed to disk before the manifest is updated.
+
+        Parameters
+        ----------
+        start : `int`, required
+            First row.
+        stop : `int`, required
+            Last row + 1.
+        """
+        self.volume.flush()
+        self.completed.update(range(start, stop))
+        self.__manifest['completed'] = sorted(self.completed)
+        self.__write_manifest()
+
+    def finish(self):
+        """ Flushes the volume and deletes the manifest once all rows have been completed.
+
+        Return
+        -------
+        `bool`
+            Whether the volume is complete.
+        """
+        self.volume.flush()
+        if not self.is_complete:
+            return False
+        os.remove(self.__manifest_path)
+        return True
@@ -1,11 +1,16 @@
+import time
 import serial
 import atexit
 import warnings
+try:
+    from modules.latency import LatencyHistogram
+except ImportError:  # When executed in the modules directory
+    from latency import LatencyHistogram
 
 class Crux:
     """Class to control 1-axis auto stage (CRUX)
     """
-    def __init__(self,port:str,baudrate=9600):
+    def __init__(self,port:str,baudrate=9600,timeout=10.,move_timeout=300.):
         """Initiates and unlock communication with the device.
 
         Parameters
@@ -16,6 +21,12 @@ class Crux:
         baudrate : `str`, optional,
             Baud rate. Default to 9600.
 
+        timeout : `float`, optional
+            Maximum waiting time for a reply[sec].
+
+        move_timeout : `float`, optional
+            Maximum waiting time for the reply of a move with ret_form=0 (sent after the move is finished)[sec].
+
         Raise
         ---------
         CruxError :
@@ -24,11 +35,18 @@ class Crux:
         """
         self.__port=port
         self.__baudrate=baudrate
+        self.__timeout=timeout
+        self.__move_timeout=move_timeout
+        self.__lost=False #a reply was not received in time (it may arrive later)
+        self.latency=LatencyHistogram() #round trip of each command (see `LatencyHistogram.dump`)
+        self.__mpi={1:None,2:None} #last (mode, velocity) set by MPI for each axis
+        self.__position={1:None,2:None} #position after the issued moves (None: unknown)
     
         try:
             self.__ser=serial.Serial(
                 port=self.__port,
                 baudrate=self.__baudrate,
+                timeout=self.__timeout,
             )
         except serial.serialutil.SerialException:
             raise CruxError(msg="CRUX not found.")
@@ -41,8 +59,9 @@ class Crux:
         self.move_origin()
         print("CRUX is ready.")
 
-    def __send_cmd(self,cmd:str,param=[]):
-        """Format the command string and send it to the controller.
+    @staticmethod
+    def format_cmd(cmd:str,param=[]):
+        """Format the command string (STX + command + parameters separated by '/' + CRLF).
         """
         command='\2'+cmd
         for i in range(len(param)):
@@ -50,13 +69,42 @@ class Crux:
             if i+1 !=len(param):
                 command=command+'/'
         command=command+'\r\n'
-        self.__ser.write(command.encode('ascii'))
+        return command.encode('ascii')
+
+    def __send_cmd(self,cmd:str,param=[]):
+        """Format the command string and send it to the controller.
+        """
+        self.__ser.write(Crux.format_cmd(cmd,param))
     
-    def __read(self):
+    def __read(self,timeout=None):
         """ Receive a reply from the controller.
+
+        Raise
+        ---------
+        CruxError :
+            When the reply is not received within the timeout.
+        """
+        timeout=self.__timeout if timeout is None else timeout
+        if self.__ser.timeout!=timeout:
+            self.__ser.timeout=timeout
+        result=self.__ser.readline()
+        if not result.endswith(b'\n'):
+            self.__lost=True
+            raise CruxError(msg='No reply from CRUX within {} sec.'.format(timeout))
+        return result.decode('utf-8').split()
+
+    def __query(self,cmd:str,param=[],ret_form=1):
+        """ Send a command and receive the reply. The round trip is recorded in `latency`.
+        The reply of a move with ret_form=0 is waited for up to `move_timeout`.
         """
-        result=self.__ser.readline().decode('utf-8')
-        return result.split()
+        if self.__lost: #discard the late reply of the command that timed out
+            self.__ser.reset_input_buffer()
+            self.__lost=False
+        start=time.perf_counter()
+        self.__send_cmd(cmd,param)
+        responce=self.__read(self.__move_timeout if ret_form==0 else None)
+        self.latency.record(cmd,time.perf_counter()-start)
+        return responce
     
     def __error_handling(self,warn=True,responce=None):
         """This function checks for errors based on the response from the device.
@@ -71,8 +119,7 @@ class Crux:
     def read_hw_info(self):
         """Get device name and firmware version
         """
-        self.__send_cmd('IDN')
-        return self.__read()
+        return self.__query('IDN')
     
     def move_origin(self,axis_num=0,velocity=9,ret_form=0):
         """Return the stage to its origin.
@@ -95,13 +142,15 @@ class Crux:
             other : Not supported
         """
         if axis_num==0:
-            self.__send_cmd('ORG',[1,velocity,0])
-            self.__error_handling()
-            self.__send_cmd('ORG',[2,velocity,0])
-            self.__error_handling()
+            self.__position={1:None,2:None}
+            self.__error_handling(responce=self.__query('ORG',[1,velocity,0],0))
+            self.__position[1]=0
+            self.__error_handling(responce=self.__query('ORG',[2,velocity,0],0))
+            self.__position[2]=0
         else:
-            self.__send_cmd('ORG',[axis_num,velocity,ret_form])
-            self.__error_handling()
+            self.__position[axis_num]=None
+            self.__error_handling(responce=self.__query('ORG',[axis_num,velocity,ret_form],ret_form))
+            self.__position[axis_num]=0
 
     def absolute_move(self,position:int,axis_num=1,velocity=9,ret_form=0):
         """Move stage to the absolute position.
@@ -125,9 +174,10 @@ class Crux:
             1 : Device responds immediately upon receiving a signal
             other : Not supported
         """
-        self.__send_cmd('APS',[axis_num,velocity,position,ret_form])
-        self.__error_handling()
-    def biaxial_move(self, v:int, vmode:str, h:int, hmode:str, velocity=9):
+        self.__position[axis_num]=None
+        self.__error_handling(responce=self.__query('APS',[axis_num,velocity,position,ret_form],ret_form))
+        self.__position[axis_num]=position
+    def biaxial_move(self, v:int, vmode:str, h:int, hmode:str, velocity=9, ret_form=0):
         """Move two stages together.
 
         Parameters
@@ -148,23 +198,25 @@ class Crux:
             other : Not supported
         velocity : `int`, optional
             stage movement speed.This value can be set in the range of 1 to 9.
+        ret_form : `int`, optional
+            0 : Device responds when the operation is complete
+            1 : Device responds immediately upon receiving a signal
+            other : Not supported
         """
-        if hmode == 'a':
-            self.__send_cmd('MPI',[1,0,velocity])
-        elif hmode == 'r':
-            self.__send_cmd('MPI',[1,1,velocity])
-        else:
+        if hmode not in ('a','r'):
             raise CruxError(msg='Invalid value was set to hmode.')
-        self.__error_handling()
-        if vmode == 'a':
-            self.__send_cmd('MPI',[2,0,velocity])
-        elif vmode =='r':
-            self.__send_cmd('MPI',[2,1,velocity])
-        else:
+        if vmode not in ('a','r'):
             raise CruxError(msg='Invalid value was set to vmode.')
-        self.__error_handling()
-        self.__send_cmd('MPS',[1,h,2,v,0])
-        self.__error_handling()
+        for axis_num,mode in ((1,hmode),(2,vmode)):
+            setting=(0 if mode=='a' else 1,velocity)
+            if self.__mpi[axis_num]!=setting: #the controller keeps the setting, so it is sent only when it changes
+                self.__mpi[axis_num]=None
+                self.__error_handling(responce=self.__query('MPI',[axis_num,*setting]))
+                self.__mpi[axis_num]=setting
+        targets={1:h if hmode=='a' else self.__shift(1,h),2:v if vmode=='a' else self.__shift(2,v)}
+        self.__position={1:None,2:None}
+        self.__error_handling(responce=self.__query('MPS',[1,h,2,v,ret_form],ret_form))
+        self.__position=targets
 
     def relative_move(self,distance:int,axis_num=1,velocity=9,ret_form=0):
         """Moves from the current position to the position of the set travel distance.
@@ -188,8 +240,10 @@ class Crux:
             1 : Device responds immediately upon receiving a signal
             other : Not supported
         """
-        self.__send_cmd('RPS',[axis_num,velocity,distance,ret_form])
-        self.__error_handling()
+        target=self.__shift(axis_num,distance)
+        self.__position[axis_num]=None
+        self.__error_handling(responce=self.__query('RPS',[axis_num,velocity,distance,ret_form],ret_form))
+        self.__position[axis_num]=target
 
     def read_position(self,axis_num:int):
         """Reads the current position value (pulse counter value).
@@ -207,10 +261,77 @@ class Crux:
         `int`
             Current position value (pulse counter value).
         """
-        self.__send_cmd('RDP',[axis_num])
-        responce=self.__read()
+        responce=self.__query('RDP',[axis_num])
         self.__error_handling(responce=responce)
         return int(responce[2])
+
+    def __shift(self,axis_num,distance):
+        """Tracked position after a relative move (None if the current position is unknown).
+        """
+        return None if self.__position[axis_num] is None else self.__position[axis_num]+distance
+
+    def position(self,axis_num:int,verify=False):
+        """Returns the position tracked from the issued moves, without communicating with the device.
+        The position is read from the device only if it is unknown (e.g. after `move_cont` or `stop`) or if `verify` is True.
+        After a move with ret_form=1, this is the target position (the stage may still be moving).
+
+        Parameters
+        ----------
+        axis_num : `int`, required
+            1 : Horizontal motorized stage
+            2 : Vertical motorized stage
+            other : Not supported
+
+        verify : `bool`, optional
+            If True, the position is read from the device and compared with the tracked one.
+            A warning is issued if they differ, and the tracked position is corrected.
+
+        Return
+        ----------
+        `int`
+            Position value [pulse].
+        """
+        tracked=self.__position[axis_num]
+        if verify or tracked is None:
+            current=self.read_position(axis_num)
+            if tracked is not None and current!=tracked:
+                warnings.warn('Tracked position of axis {} was {}, but the device returned {}.'.format(axis_num,tracked,current))
+            self.__position[axis_num]=current
+        return self.__position[axis_num]
+
+    def wait_position(self,position:int,axis_num=1,interval=0.005,timeout=10.):
+        """Waits until the stage reaches the target position.
+        Used after a move with ret_form=1 to poll the completion of the operation.
+
+        Parameters
+        ----------
+        position : `int`, required
+            Target absolute position[pulse].
+
+        axis_num : `int`, optional
+            1 : Horizontal motorized stage
+            2 : Vertical motorized stage
+            other : Not supported
+
+        interval : `float`, optional
+            Polling interval[sec].
+
+        timeout : `float`, optional
+            Maximum waiting time[sec].
+
+        Raise
+        ---------
+        CruxError :
+            When the stage does not reach the target position within the timeout.
+        """
+        deadline=time.monotonic()+timeout
+        while True:
+            current=self.read_position(axis_num)
+            if current==position:
+                return
+            if time.monotonic()>deadline:
+                raise CruxError(msg='Stage did not reach the target position.(axis:{}, target:{}, current:{})'.format(axis_num,position,current))
+            time.sleep(interval)
     
     def move_cont(self,rot_way:int,axis_num=1,velocity=0):
         """Keep stage moving until stop command is issued.
@@ -232,8 +353,8 @@ class Crux:
         velocity : `int`, optional
             Stage movement speed.This value can be set in the range of 1 to 9.
         """
-        self.__send_cmd('FRP',[axis_num,velocity,rot_way])
-        self.__error_handling()
+        self.__position[axis_num]=None
+        self.__error_handling(responce=self.__query('FRP',[axis_num,velocity,rot_way]))
     
     def stop(self,axis_num=1,stop_mode=0):
         """Interrupts the operation of the stage like the emergency stop button.
@@ -251,8 +372,9 @@ class Crux:
             1 : Emergency stop
             other : Not supported
         """
-        self.__send_cmd('STP',[axis_num,stop_mode])
-        self.__error_handling()
+        for axis in ((1,2) if axis_num==0 else (axis_num,)):
+            self.__position[axis]=None
+        self.__error_handling(responce=self.__query('STP',[axis_num,stop_mode]))
 
     def close(self):
         """ Release the instrument and device driver and terminate the connection.
@@ -0,0 +1,50 @@
+""" Module for the chirp-z (zoom FFT) transform.
+
+The discrete-time Fourier transform X(ω) = Σ x[n]·exp(jωn) is evaluated on an arbitrary, evenly spaced
+grid of ω with Bluestein's algorithm, i.e. as a convolution with a chirp computed by FFT.
+This costs O((N+M)log(N+M)) for N samples and M output points, instead of O(N·M) for a dense DFT,
+and the output grid does not have to start at zero or match the FFT bins.
+"""
+import numpy as np
+from scipy import fft
+
+
+def chirp_z(x, m, step, start=0.0, axis=-1, workers=None):
+    """ Evaluates the DTFT of the data at ω = start + k·step (k = 0, 1, ..., m-1).
+
+    Parameters
+    ----------
+    x : `ndarray`, required
+        Data sampled evenly. Real or complex.
+        Single precision data (float32, complex64) is transformed in single precision.
+    m : `int`, required
+        Number of output points.
+    step : `float`, required
+        Interval of the output grid [rad/sample].
+    start : `float`
+        First point of the output grid [rad/sample].
+    axis : `int`
+        Axis of `x` along which the transform is calculated.
+    workers : `int`
+        Number of threads used by `scipy.fft`. If not specified, single-threaded.
+
+    Returns
+    -------
+    `ndarray` (complex)
+        Σ x[n]·exp(j(start + k·step)n) for each k. The length of `axis` becomes `m`.
+    """
+    x = np.moveaxis(np.asarray(x), axis, -1)
+    ctype = np.result_type(x.dtype, np.complex64)  # complex64 for single precision data, otherwise complex128
+    n = x.shape[-1]
+    length = fft.next_fast_len(n+m-1)
+    # nk = (n^2 + k^2 - (k-n)^2)/2, so the transform becomes a convolution with a chirp
+    # (the phases are calculated in double precision and rounded afterwards)
+    i = np.arange(max(n, m), dtype=float)
+    chirp = np.exp(0.5j*step*i**2).astype(ctype)
+    y = np.zeros(x.shape[:-1]+(length,), dtype=ctype)
+    y[..., :n] = x*(np.exp(1j*start*i[:n]).astype(ctype)*chirp[:n])
+    h = np.zeros(length, dtype=ctype)
+    h[:m] = np.conj(chirp[:m])
+    h[length-n+1:] = np.conj(chirp[1:n][::-1])
+    result = fft.ifft(fft.fft(y, axis=-1, workers=workers)*fft.fft(h), axis=-1, workers=workers)[..., :m]*chirp[:m]
+    return np.moveaxis(result, -1, axis)
@@ -3,6 +3,7 @@
 """
 import os
 import glob
+import zipfile
 import datetime
 import pandas as pd
 import numpy as np
@@ -102,6 +103,111 @@ def output_datainfo_calculated(data):
     print('<data information>\ndate:{}\nmemo:{}\nresolution:{}\ndepth_max:{}mm\nn:{}\nwidth:{}mm/height:{}mm\n' 
     .format(data['date'][0],data['memo'][0],data['resolution'][0],data['depth_max'][0],data['n'][0],data['width'][0],data['height'][0]))
 
+def _read_npy_header(f):
+    """ Reads the header of a .npy stream and returns (shape, fortran_order, dtype).
+    """
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        return np.lib.format.read_array_header_1_0(f)
+    return np.lib.format.read_array_header_2_0(f)
+
+def _open_npz_member(file_path, key):
+    """ Opens a member of a .npz file as a (decompressing) stream.
+    """
+    zf = zipfile.ZipFile(file_path)
+    try:
+        return zf, zf.open(key+'.npy')
+    except KeyError:
+        zf.close()
+        raise KeyError('{} is not a file in the archive {}.'.format(key, file_path))
+
+def load_array_info(file_path, key=None):
+    """ Reads the shape and data type of an array without loading its contents.
+
+    Parameters
+    ----------
+    file_path : `str`, required
+        .npy file, or .npz file generated by `save_spectra_3d`, etc.
+    key : `str`
+        Name of the array in the .npz file (e.g. 'spectra'). Not used for .npy files.
+
+    Returns
+    -------
+    shape : `tuple`
+        Shape of the array.
+    dtype : `numpy.dtype`
+        Data type of the array.
+    """
+    if file_path.endswith('.npy'):
+        with open(file_path, 'rb') as f:
+            shape, _, dtype = _read_npy_header(f)
+        return shape, dtype
+    zf, f = _open_npz_member(file_path, key)
+    with zf, f:
+        shape, _, dtype = _read_npy_header(f)
+    return shape, dtype
+
+def iter_array(file_path, key=None, rows=1):
+    """ Reads an array in chunks along axis0, so that the whole array is never loaded into memory.
+    Compressed members of .npz files (e.g. saved by `save_spectra_3d`) are decompressed on the fly,
+    and .npy files are memory-mapped.
+
+    Parameters
+    ----------
+    file_path : `str`, required
+        .npy file, or .npz file generated by `save_spectra_3d`, etc.
+    key : `str`
+        Name of the array in the .npz file (e.g. 'spectra'). Not used for .npy files.
+    rows : `int`
+        Number of elements of axis0 read at once. For 3D spectra, 1 corresponds to one B-scan.
+
+    Yields
+    -------
+    chunk : `ndarray`
+        Array of `rows` elements of axis0 (the last chunk may be shorter). Chunks of .npy files are read-only
+        views of the memory map; chunks of .npz files are writable arrays read into a new buffer.
+    """
+    if file_path.endswith('.npy'):
+        array = np.load(file_path, mmap_mode='r')
+        for i in range(0, len(array), rows):
+            yield np.asarray(array[i:i+rows])
+        return
+    zf, f = _open_npz_member(file_path, key)
+    with zf, f:
+        shape, fortran_order, dtype = _read_npy_header(f)
+        if fortran_order or dtype.hasobject:
+            raise ValueError('{} in {} can not be read in chunks.'.format(key, file_path))
+        row_bytes = dtype.itemsize*int(np.prod(shape[1:]))
+        for i in range(0, shape[0], rows):
+            n = min(rows, shape[0]-i)
+            buffer = bytearray(n*row_bytes)
+            view, filled = memoryview(buffer), 0
+            while filled < len(buffer):
+                size = f.readinto(view[filled:])
+                if not size:
+                    raise ValueError('{} in {} is truncated.'.format(key, file_path))
+                filled += size
+            yield np.frombuffer(buffer, dtype=dtype).reshape((n,)+tuple(shape[1:]))
+
+def create_volume(file_path, shape, dtype=float):
+    """ Creates a .npy file that can be filled in gradually through memory mapping.
+
+    Parameters
+    ----------
+    file_path : `str`, required
+        Where the file is stored (.npy).
+    shape : `tuple`, required
+        Shape of the array.
+    dtype : `numpy.dtype`
+        Data type of the array.
+
+    Return
+    -------
+    `numpy.memmap`
+        Writable array mapped to the file. Call `flush()` when writing is finished.
+    """
+    return np.lib.format.open_memmap(file_path, mode='w+', dtype=dtype, shape=tuple(shape))
+
 def load_spectra(file_path, wavelength_range=[0,2000]):
     """ Load the spectra. The data format is the same as the one saved by `self.save_spectra`.
 
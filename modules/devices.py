@@ -0,0 +1,74 @@
+""" Module for selecting the device drivers or their simulated backends (`simulated_devices`).
+
+Set the environment variable OCT_SIMULATE to use the simulated devices:
+'1' or 'all' for all devices, or a comma-separated list of the devices to be simulated
+(ccs175m, pma12, crux, fine01r, artcam130mi), e.g. OCT_SIMULATE=crux,fine01r.
+The programs import the devices from this module. A driver is imported only when one of its classes is imported
+from this module, and not at all if the device is simulated, so only the DLLs and serial ports of the devices
+actually used by a program are needed.
+"""
+import os
+from importlib import import_module
+
+names = ('ccs175m', 'pma12', 'crux', 'fine01r', 'artcam130mi')  # Devices that can be simulated (module names)
+_package = 'modules.' if __name__.startswith('modules.') else ''  # '' when executed in the modules directory
+
+
+def simulated(name):
+    """ Whether the device is simulated.
+
+    Parameter
+    ----------
+    name : `str`, required
+        Module name of the device driver (one of `names`).
+
+    Return
+    ----------
+    `bool`
+    """
+    value = os.environ.get('OCT_SIMULATE', '').strip().lower()
+    if value in ('', '0', 'false', 'no'):
+        return False
+    if value in ('1', 'all', 'true', 'yes'):
+        return True
+    selected = [v.strip() for v in value.split(',')]
+    unknown = set(selected)-set(names)
+    if unknown:
+        raise ValueError("Unknown devices in OCT_SIMULATE: {}".format(', '.join(sorted(unknown))))
+    return name in selected
+
+
+def _load(name, *attributes):
+    """ Classes of the driver `name`, or of the simulated device.
+    """
+    module = import_module(_package+('simulated_devices' if simulated(name) else name))
+    return tuple(getattr(module, attribute) for attribute in attributes)
+
+
+_classes = {  # {class name: (module name of the driver, class names)}
+    'Ccs175m': ('ccs175m', 'Ccs175m', 'CcsError'), 'CcsError': ('ccs175m', 'Ccs175m', 'CcsError'),
+    'Pma12': ('pma12', 'Pma12', 'PmaError'), 'PmaError': ('pma12', 'Pma12', 'PmaError'),
+    'Crux': ('crux', 'Crux', 'CruxError'), 'CruxError': ('crux', 'Crux', 'CruxError'),
+    'Fine01r': ('fine01r', 'Fine01r', 'Fine01rError'), 'Fine01rError': ('fine01r', 'Fine01r', 'Fine01rError'),
+    'ArtCam130': ('artcam130mi', 'ArtCam130', 'ArtCamError'), 'ArtCamError': ('artcam130mi', 'ArtCam130', 'ArtCamError'),
+}
+
+
+def __getattr__(attribute):
+    """ Loads a driver when one of its classes is first imported (e.g. `from modules.devices import Pma12`),
+    so a program needs only the DLLs and packages of the devices it uses.
+    """
+    if attribute not in _classes:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, attribute))
+    name, *attributes = _classes[attribute]
+    try:
+        classes = _load(name, *attributes)
+    except AttributeError as e:  # Would be reported as a missing class of this module (e.g. no ctypes.windll)
+        raise ImportError("Driver {} could not be loaded: {}".format(name, e)) from e
+    for key, value in zip(attributes, classes):
+        globals()[key] = value
+    return globals()[attribute]
+
+
+def __dir__():
+    return sorted(list(globals())+list(_classes))
@@ -0,0 +1,174 @@
+""" Module for the FFT backend of the FFT-based signal processor.
+
+The A-scan is the magnitude of the inverse FFT of the real (windowed) spectra, zero-padded to nf samples,
+of which only the first ns bins are used. For real input, ifft(x)[k] = conj(rfft(x)[k])/nf, so the same
+magnitude is obtained from a real-input FFT, which computes only half of the spectrum.
+The transforms are run on all cores with `scipy.fft` (plans are cached by scipy), or with pyFFTW when it
+is installed (plans are created once per data shape and reused). The zero-padded input buffers are kept
+between calls, so only the data part has to be copied. With pyFFTW, or with `numpy.fft` (numpy>=2.0), the
+transform output is also preallocated, so `magnitude(..., out=)` does not allocate memory.
+`prepare` provides buffers for spectra of a fixed shape whose transform never allocates memory (used by the
+workspaces of the live view): the frequency axis is laid out last, so the transform runs on contiguous rows,
+and `numpy.fft` with `out=` is used instead of `scipy.fft`, which always returns a new array.
+"""
+import os
+import numpy as np
+from scipy import fft
+try:
+    import pyfftw
+except ImportError:  # pyFFTW is optional
+    pyfftw = None
+
+_numpy_out = np.lib.NumpyVersion(np.__version__) >= '2.0.0'  # numpy.fft accepts out=
+
+
+class FFTBackend:
+    """ Magnitude of the zero-padded inverse FFT along axis0.
+    """
+    max_plans = 4  # Number of spectra shapes whose buffers (and plans) are kept
+
+    def __init__(self, length, bins, backend=None, workers=None, dtype=float):
+        """ Selection of the backend.
+
+        Parameters
+        ----------
+        length : `int`, required
+            Number of samples after zero-padding (nf).
+        bins : `int`, required
+            Number of output bins (ns). Must be at most length//2+1.
+        backend : `str`
+            'scipy' : `scipy.fft` (multithreaded with `workers`).
+            'pyfftw' : pyFFTW. Raises ImportError if it is not installed.
+            'numpy' : `numpy.fft` (single-threaded, same as the original implementation).
+            If not specified, 'pyfftw' is used when installed, otherwise 'scipy'.
+        workers : `int`
+            Number of threads. If not specified, the number of CPUs.
+        dtype : `numpy.dtype`
+            Precision of the transform (float64 or float32). Real spectra are converted to this type.
+        """
+        if backend is None:
+            backend = 'scipy' if pyfftw is None else 'pyfftw'
+        if backend not in ('scipy', 'pyfftw', 'numpy'):
+            raise ValueError("backend must be 'scipy', 'pyfftw' or 'numpy'.")
+        if backend == 'pyfftw' and pyfftw is None:
+            raise ImportError("pyFFTW is not installed.")
+        if bins > length//2+1:
+            raise ValueError("bins must be at most length//2+1.")
+        self.backend = backend
+        self.workers = os.cpu_count() if workers is None else workers
+        self.__length = length
+        self.__bins = bins
+        self.__dtype = np.dtype(dtype)
+        self.__ctype = np.result_type(self.__dtype, np.complex64)
+        self.__plans = {}  # {data shape: (padded input buffer, transform)}
+
+    def buffer(self, shape):
+        """ Zero-padded input buffer used for spectra of the shape.
+        Spectra written directly into `buffer(shape)[:shape[0]]` are transformed by `magnitude` without being copied.
+
+        Parameters
+        ----------
+        shape : `tuple`, required
+            Shape of the spectra (axis0 is the frequency axis).
+
+        Returns
+        -------
+        `ndarray`
+            (length,)+shape[1:] buffer. Elements after shape[0] must stay zero.
+        """
+        return self.__plan(tuple(shape))[0]
+
+    def __plan(self, shape):
+        """ Returns the zero-padded buffer and the real-input transform for spectra of the shape.
+        """
+        if shape in self.__plans:
+            return self.__plans[shape]
+        if len(self.__plans) >= FFTBackend.max_plans:
+            self.__plans.pop(next(iter(self.__plans)))  # Oldest first
+        full = (self.__length,)+shape[1:]
+        if self.backend == 'pyfftw':
+            buffer = pyfftw.zeros_aligned(full, dtype=self.__dtype)
+            output = pyfftw.empty_aligned((self.__length//2+1,)+shape[1:], dtype=self.__ctype)
+            plan = pyfftw.FFTW(buffer, output, axes=(0,), threads=self.workers, flags=('FFTW_MEASURE',))
+            buffer[:] = 0  # FFTW_MEASURE overwrites the buffer
+            transform = plan
+        elif self.backend == 'scipy':
+            buffer = np.zeros(full, dtype=self.__dtype)
+            transform = lambda: fft.rfft(buffer, axis=0, workers=self.workers)
+        elif _numpy_out:
+            buffer = np.zeros(full, dtype=self.__dtype)
+            output = np.empty((self.__length//2+1,)+shape[1:], dtype=self.__ctype)
+            transform = lambda: np.fft.rfft(buffer, axis=0, out=output)
+        else:
+            buffer = np.zeros(full, dtype=self.__dtype)
+            transform = lambda: np.fft.rfft(buffer, axis=0)
+        self.__plans[shape] = (buffer, transform)
+        return self.__plans[shape]
+
+    def prepare(self, shape):
+        """ Buffers and transform for spectra of a fixed shape that do not allocate memory per call.
+        The zero-padded input and the transform output are laid out with the frequency axis last.
+        With the 'scipy' backend, `numpy.fft` is used (single-threaded). With numpy<2.0 and without pyFFTW,
+        the transform output is still allocated by `numpy.fft`.
+
+        Parameters
+        ----------
+        shape : `tuple`, required
+            Shape of the spectra (axis0 is the frequency axis, at most `length` long).
+
+        Returns
+        -------
+        spectra : `ndarray`
+            View of the zero-padded input of the given shape. Write the spectra here.
+        transform : `callable`
+            transform(out) writes |ifft(spectra, n=length, axis=0)[:bins]| to `out` ((bins,)+shape[1:]) and returns it.
+        """
+        trailing = tuple(shape[1:])
+        full, half = trailing+(self.__length,), trailing+(self.__length//2+1,)
+        if self.backend == 'pyfftw':
+            padded = pyfftw.zeros_aligned(full, dtype=self.__dtype)
+            output = pyfftw.empty_aligned(half, dtype=self.__ctype)
+            run = pyfftw.FFTW(padded, output, axes=(-1,), threads=self.workers, flags=('FFTW_MEASURE',))
+            padded[:] = 0  # FFTW_MEASURE overwrites the buffer
+        else:
+            padded = np.zeros(full, dtype=self.__dtype)
+            output = np.empty(half, dtype=self.__ctype)
+            run = (lambda: np.fft.rfft(padded, axis=-1, out=output)) if _numpy_out else (lambda: np.fft.rfft(padded, axis=-1))
+        spectra = np.moveaxis(padded[..., :shape[0]], -1, 0)
+        bins = np.moveaxis(output[..., :self.__bins], -1, 0)
+        length, count = self.__length, self.__bins
+
+        def transform(out):
+            result = run()
+            np.abs(bins if result is output else np.moveaxis(result[..., :count], -1, 0), out=out)
+            out /= length
+            return out
+        return spectra, transform
+
+    def magnitude(self, spectra, out=None):
+        """ Calculates |ifft(spectra, n=length, axis=0)[:bins]|.
+
+        Parameters
+        ----------
+        spectra : `ndarray`, required
+            Spectra with axis0 as the frequency axis and any trailing shape.
+            Complex spectra are transformed with a full complex IFFT.
+        out : `ndarray`
+            Where the result is written. If not specified, a new array is returned.
+
+        Returns
+        -------
+        `ndarray`
+            Magnitude of the first `bins` bins of the inverse FFT.
+        """
+        spectra = np.asarray(spectra)
+        if np.iscomplexobj(spectra):
+            transformed = fft.ifft(spectra, n=self.__length, axis=0, workers=self.workers)
+            return np.abs(transformed[:self.__bins], out=out)
+        buffer, transform = self.__plan(spectra.shape)
+        if not np.may_share_memory(buffer, spectra):  # Already written by the caller (see `buffer`)
+            buffer[:spectra.shape[0]] = spectra  # The rest stays zero
+        transformed = transform()
+        out = np.abs(transformed[:self.__bins], out=out)
+        out /= self.__length
+        return out
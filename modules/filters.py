@@ -0,0 +1,94 @@
+""" Module for smoothing filters applied along any axis of N-dimensional data.
+
+The filters process all lines of a B-scan (or all spectra of an absorbance map) in one call:
+the moving average is calculated from a cumulative sum (O(w) regardless of the filter size),
+the median with the rank filter of `scipy.ndimage` (no index matrix), and the low-pass filter with a real FFT.
+The results are the same as the 1-dimensional filters of `SignalProcessor` applied to each line.
+"""
+import numpy as np
+from scipy import fft, ndimage
+
+
+def moving_average(array, filter_size, axis=-1):
+    """ Moving average filter. Same as np.convolve(line, np.ones(filter_size)/filter_size, mode='same') for each line,
+    i.e. the data outside the array is treated as 0.
+
+    Parameters
+    ----------
+    array : `ndarray`, required
+        Data to be filtered.
+    filter_size : `int`, required
+        Number of samples averaged. It must not exceed the length of `axis`.
+    axis : `int`
+        Axis along which the filter is applied.
+
+    Returns
+    -------
+    `ndarray`
+        Filtered data.
+    """
+    data = np.moveaxis(np.asarray(array), axis, -1)
+    n = data.shape[-1]
+    total = np.zeros(data.shape[:-1]+(n+1,))
+    np.cumsum(data, axis=-1, out=total[..., 1:])
+    end = np.arange(n) + (filter_size-1)//2  # Last sample of each window
+    upper = np.minimum(end, n-1) + 1
+    lower = np.maximum(end-filter_size+1, 0)
+    result = (total[..., upper]-total[..., lower]) / filter_size
+    return np.moveaxis(result.astype(np.result_type(data.dtype, np.float32), copy=False), -1, axis)
+
+
+def median(array, filter_size, axis=-1):
+    """ Median filter. The edges are extended with the nearest value.
+    For an even `filter_size`, the mean of the two middle values is used (same as np.median).
+
+    Parameters
+    ----------
+    array : `ndarray`, required
+        Data to be filtered.
+    filter_size : `int`, required
+        Number of samples in the window.
+    axis : `int`
+        Axis along which the filter is applied.
+
+    Returns
+    -------
+    `ndarray`
+        Filtered data.
+    """
+    data = np.asarray(array)
+    size = [1]*data.ndim
+    size[axis] = filter_size
+    if filter_size % 2:
+        return ndimage.median_filter(data, size=size, mode='nearest')
+    lower = ndimage.rank_filter(data.astype(float, copy=False), filter_size//2-1, size=size, mode='nearest')
+    upper = ndimage.rank_filter(data.astype(float, copy=False), filter_size//2, size=size, mode='nearest')
+    return (lower+upper) / 2
+
+
+def low_pass(array, cutoff, axis=-1, workers=None):
+    """ Digital low pass filter. The frequency components above `cutoff` are removed.
+
+    Parameters
+    ----------
+    array : `ndarray`, required
+        Real data to be filtered.
+    cutoff : `int`, required
+        Highest frequency component (index of the FFT bin) that is kept. Must be smaller than half the length of `axis`.
+    axis : `int`
+        Axis along which the filter is applied.
+    workers : `int`
+        Number of threads used by `scipy.fft`.
+
+    Returns
+    -------
+    `ndarray`
+        Filtered data.
+    """
+    data = np.asarray(array)
+    n = data.shape[axis]
+    spectrum = fft.rfft(data, axis=axis, workers=workers)
+    index = [slice(None)]*data.ndim
+    index[axis] = slice(int(cutoff)+1, None)
+    spectrum[tuple(index)] = 0
+    return fft.irfft(spectrum, n=n, axis=axis, workers=workers)
@@ -0,0 +1,123 @@
+""" Module for compiled kernels of the A-scan calculation (optional).
+
+If numba is installed, the whole calculation of `SignalProcessorHamasaki` with the sine wave data set
+(resampling, background removal with the scale of each line, transform and normalization) is compiled into
+a single pass that processes the A-lines in parallel. The compiled code is cached in `modules/tools/cache/numba`
+(or NUMBA_CACHE_DIR if it is set), so it is compiled only on the first launch. The cache is kept separately for
+each import name of this module ('kernels' from the scripts in `modules`, 'modules.kernels' from the others),
+because a compiled kernel can only be loaded under the name it was compiled with.
+Without numba, the same functions are evaluated with numpy and scipy.
+"""
+import os
+import numpy as np
+from scipy import sparse
+try:
+    import numba
+except ImportError:  # numba is optional
+    numba = None
+
+available = numba is not None  # Whether the compiled kernels are used
+cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tools', 'cache', 'numba')  # Default cache directory
+
+
+def _ascan_numpy(spectra, indptr, indices, weights, reference, table, out):
+    operator = sparse.csr_matrix((weights, indices, indptr), shape=(len(indptr)-1, spectra.shape[1]))
+    resampled = (operator @ spectra.T).T
+    scale = np.amax(resampled, axis=1, keepdims=True)/np.amax(reference)
+    np.dot(resampled-reference*scale, table, out=out)
+    out /= np.amax(out, axis=1, keepdims=True)
+    np.abs(out, out=out)
+
+
+def _enable_cache(dispatcher):
+    """ Caches the compiled code of `dispatcher` in `cache_dir`/`__name__`.
+    The process-wide settings of numba are not changed. If the caching machinery of the installed numba
+    is not compatible, the kernel is compiled on each launch instead.
+    """
+    try:
+        from numba.core import caching
+
+        class Locator(caching._SourceFileBackedLocatorMixin, caching._CacheLocator):
+            def __init__(self, py_func, py_file):
+                self._py_file = py_file
+                self._lineno = py_func.__code__.co_firstlineno
+
+            def get_cache_path(self):
+                return os.path.join(numba.config.CACHE_DIR or cache_dir, __name__)
+
+        class Impl(caching.CompileResultCacheImpl):
+            _locator_classes = [Locator]
+
+        class FunctionCache(caching.FunctionCache):
+            _impl_class = Impl
+
+        dispatcher._cache = FunctionCache(dispatcher.py_func)
+    except (AttributeError, TypeError, RuntimeError):  # Incompatible numba or the cache directory is not writable
+        pass
+    return dispatcher
+
+
+if available:
+    @_enable_cache
+    @numba.njit(parallel=True)
+    def _ascan_numba(spectra, indptr, indices, weights, reference, table, out):
+        lines, resolution = out.shape
+        n = len(indptr)-1
+        ref_max = reference.max()
+        block = 32  # A-lines per matrix product
+        for b in numba.prange((lines+block-1)//block):
+            start = b*block
+            stop = min(start+block, lines)
+            count = stop-start
+            # Resampling (sparse operator), vectorized over the A-lines of the block
+            pixels = np.ascontiguousarray(spectra[start:stop].T)
+            resampled = np.zeros((n, count), dtype=out.dtype)
+            for j in range(n):
+                for p in range(indptr[j], indptr[j+1]):
+                    w = weights[p]
+                    source = pixels[indices[p]]
+                    for i in range(count):
+                        resampled[j, i] += w*source[i]
+            # Background removal with the scale of each line
+            removed = np.ascontiguousarray(resampled.T)
+            for i in range(count):
+                scale = removed[i].max()/ref_max
+                for j in range(n):
+                    removed[i, j] -= reference[j]*scale
+            # Transform (BLAS) and normalization
+            result = np.dot(removed, table)
+            for i in range(stop-start):
+                result_max = result[i].max()
+                for k in range(resolution):
+                    out[start+i, k] = abs(result[i, k]/result_max)
+
+
+def generate_ascan(spectra, operator, reference, table, out=None):
+    """ A-scans of `SignalProcessorHamasaki` (transform='dft') in one pass.
+
+    Parameters
+    ----------
+    spectra : `2d-ndarray`, required
+        Spectra of interference light (one A-line per row), sampled evenly in wavelength space.
+    operator : `scipy.sparse.csr_matrix`, required
+        Resampling operator.
+    reference : `1d-ndarray`, required
+        Reference spectra after resampling.
+    table : `2d-ndarray`, required
+        Sine wave data set.
+    out : `2d-ndarray`
+        Where the A-scans are written. If not specified, a new array is returned.
+
+    Returns
+    -------
+    `2d-ndarray`
+        A-scans, each normalized by its own maximum value.
+    """
+    dtype = table.dtype
+    spectra = np.ascontiguousarray(spectra, dtype=dtype)
+    if out is None:
+        out = np.empty((len(spectra), table.shape[1]), dtype=dtype)
+    kernel = _ascan_numba if available else _ascan_numpy
+    kernel(spectra, operator.indptr, operator.indices, operator.data.astype(dtype, copy=False),
+           np.asarray(reference, dtype=dtype), np.asarray(table), out)
+    return out
@@ -0,0 +1,81 @@
+""" Module for recording the latency of device commands.
+
+The round trip of each command is counted in logarithmic bins (0.1 ms to 10 s), so recording does not
+allocate memory however long the scan is. `dump` prints the statistics of each command after a scan.
+"""
+import json
+import numpy as np
+
+
+class LatencyHistogram:
+    """ Histograms of the latency of each command.
+    """
+    edges = np.logspace(-4, 1, 51)  # Bin edges [sec]. Shorter/longer latencies are counted in the first/last bin.
+
+    def __init__(self):
+        self.__counts = {}  # {command: counts of each bin}
+        self.__totals = {}  # {command: [sum, maximum]}
+
+    def record(self, command, seconds):
+        """ Counts a round trip.
+
+        Parameters
+        ----------
+        command : `str`, required
+            Name of the command.
+        seconds : `float`, required
+            Latency [sec].
+        """
+        if command not in self.__counts:
+            self.__counts[command] = np.zeros(len(LatencyHistogram.edges)-1, dtype=int)
+            self.__totals[command] = [0., 0.]
+        index = min(max(np.searchsorted(LatencyHistogram.edges, seconds)-1, 0), len(LatencyHistogram.edges)-2)
+        self.__counts[command][index] += 1
+        total = self.__totals[command]
+        total[0] += seconds
+        total[1] = max(total[1], seconds)
+
+    def reset(self):
+        """ Clears all histograms.
+        """
+        self.__counts.clear()
+        self.__totals.clear()
+
+    def summary(self):
+        """ Statistics of each command.
+
+        Returns
+        -------
+        `dict`
+            {command: {'count', 'total', 'mean', 'p50', 'p95', 'max'}} [sec].
+            The percentiles are the upper edges of the bins (accurate to about 25%), limited to the maximum.
+        """
+        result = {}
+        for command, counts in self.__counts.items():
+            count = int(counts.sum())
+            cumulative = np.cumsum(counts)/count
+            total, maximum = self.__totals[command]
+            result[command] = {
+                'count': count, 'total': total, 'mean': total/count,
+                'p50': min(float(LatencyHistogram.edges[np.searchsorted(cumulative, 0.5)+1]), maximum),
+                'p95': min(float(LatencyHistogram.edges[np.searchsorted(cumulative, 0.95)+1]), maximum),
+                'max': maximum}
+        return result
+
+    def dump(self, file_path=None):
+        """ Prints the statistics of each command. If `file_path` is given, the histograms are also saved (.json).
+
+        Parameters
+        ----------
+        file_path : `str`
+            Where the histograms are saved.
+        """
+        summary = self.summary()
+        print('{:>8}{:>8}{:>10}{:>10}{:>10}{:>10}{:>10}'.format('command', 'count', 'total[s]', 'mean[ms]', 'p50[ms]', 'p95[ms]', 'max[ms]'))
+        for command, s in sorted(summary.items(), key=lambda item: -item[1]['total']):
+            print('{:>8}{:>8}{:>10.3f}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}'.format(
+                command, s['count'], s['total'], s['mean']*1e3, s['p50']*1e3, s['p95']*1e3, s['max']*1e3))
+        if file_path is not None:
+            with open(file_path, 'w') as f:
+                json.dump({'edges': LatencyHistogram.edges.tolist(), 'summary': summary,
+                           'counts': {k: v.tolist() for k, v in self.__counts.items()}}, f, indent=1)
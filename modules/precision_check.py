@@ -0,0 +1,132 @@
+""" Check of the float32 calculation mode (dtype=np.float32) of the signal processors.
+
+The A-scans of synthetic OCT spectra (1024 pixels, three reflectors with fringes of 0.1-1% of the reference, and noise)
+are calculated in float32 and float64, and the deviation max|A32-A64|/max|A64| of each A-scan is compared with
+the bound documented in the processors. The deviation grows as the fringes get weaker relative to the background,
+so the bound only holds for comparable spectra.
+Run this file directly (python modules/precision_check.py) after changing the transforms; it fails if a bound is exceeded.
+"""
+import numpy as np
+try:
+    from modules.signal_processing_hamasaki import SignalProcessorHamasaki
+    from modules.signal_processor import SignalProcessor
+    from modules import kernels
+except ImportError:  # When executed in the modules directory
+    from signal_processing_hamasaki import SignalProcessorHamasaki
+    from signal_processor import SignalProcessor
+    import kernels
+
+bound = 5e-4  # Documented bound of the deviation (see the `dtype` parameter of each processor)
+
+
+def synthetic_spectra(pixels=1024, lines=32, wavelength_range=(770., 910.), n=1.5, seed=0):
+    """ Interference spectra of a sample with a few reflectors.
+
+    Parameters
+    ----------
+    pixels : `int`
+        Number of pixels of the spectra.
+    lines : `int`
+        Number of A-lines.
+    wavelength_range : `tuple`
+        Wavelength range [nm].
+    n : `float`
+        Refractive index of the sample.
+    seed : `int`
+        Seed of the reflectors and the noise.
+
+    Returns
+    -------
+    wavelength : `1d-ndarray`
+        Wavelength [nm].
+    reference : `1d-ndarray`
+        Spectra of reference light (Gaussian light source).
+    interference : `2d-ndarray`
+        Spectra of interference light (one A-line per row).
+    """
+    rng = np.random.default_rng(seed)
+    wavelength = np.linspace(wavelength_range[0], wavelength_range[1], pixels)
+    center, width = np.mean(wavelength_range), (wavelength_range[1]-wavelength_range[0])/4
+    reference = np.exp(-((wavelength-center)/width)**2)
+    depths = rng.uniform(0.02e-3, 0.25e-3, (lines, 3))  # [m]
+    amplitudes = rng.uniform(0.001, 0.01, (lines, 3))  # Relative to the reference
+    phase = 4*np.pi*n*depths[:, :, np.newaxis]/(wavelength*1e-9)
+    interference = reference*(1+np.sum(amplitudes[:, :, np.newaxis]*np.cos(phase), axis=1))
+    interference += 1e-4*rng.standard_normal(interference.shape)
+    return wavelength, reference, interference
+
+
+def deviation(single, double):
+    """ Maximum deviation of the A-scans relative to the maximum of each A-scan.
+    """
+    double = np.atleast_2d(double)
+    return float(np.max(np.abs(np.atleast_2d(single)-double)/np.amax(np.abs(double), axis=-1, keepdims=True)))
+
+
+def float32_deviations(pixels=1024, lines=32, resolution=2000, seed=0):
+    """ Deviations of the float32 A-scans from float64 for each transform.
+
+    Parameters
+    ----------
+    pixels : `int`
+        Number of pixels of the spectra.
+    lines : `int`
+        Number of A-lines.
+    resolution : `int`
+        Resolution of `SignalProcessorHamasaki` and of `SignalProcessor` with transform='czt'.
+    seed : `int`
+        Seed of the synthetic spectra.
+
+    Returns
+    -------
+    `dict`
+        {name: deviation} for 'dft', 'fused', 'czt', 'jit' (only if numba is installed), 'SignalProcessor(fft)'
+        and 'SignalProcessor(czt)'.
+    """
+    wavelength, reference, interference = synthetic_spectra(pixels, lines, seed=seed)
+    options = {'dft': {}, 'fused': {'fused': True}, 'czt': {'transform': 'czt'}}
+    if kernels.available:
+        options['jit'] = {'jit': True}
+    result = {}
+    for name, kwargs in options.items():
+        ascans = [SignalProcessorHamasaki(wavelength, 1.5, 0.3, resolution, cache=False, dtype=dtype, **kwargs)
+                  .generate_ascan(interference, reference) for dtype in (np.float64, np.float32)]
+        result[name] = deviation(ascans[1], ascans[0])
+    for transform in ('fft', 'czt'):
+        kwargs = {'depth_max': 0.3e-3, 'resolution': resolution} if transform == 'czt' else {}
+        ascans = [SignalProcessor(wavelength, 1.5, transform=transform, dtype=dtype, **kwargs)
+                  .generate_ascan(interference.T, reference).T for dtype in (np.float64, np.float32)]  # Wavelength along axis0
+        result['SignalProcessor({})'.format(transform)] = deviation(ascans[1], ascans[0])
+    return result
+
+
+def check_float32(**kwargs):
+    """ Checks that the float32 A-scans of all transforms stay within `bound`.
+
+    Parameters
+    ----------
+    **kwargs
+        Passed to `float32_deviations`.
+
+    Returns
+    -------
+    `dict`
+        {name: deviation}
+
+    Raises
+    ------
+    AssertionError
+        When a deviation exceeds its bound.
+    """
+    result = float32_deviations(**kwargs)
+    exceeded = {name: value for name, value in result.items() if value > bound}
+    if exceeded:
+        raise AssertionError('float32 deviation exceeds the documented bound ({:.0e}): '.format(bound) + ', '.join(
+            '{}={:.2e}'.format(name, value) for name, value in exceeded.items()))
+    return result
+
+
+if __name__ == "__main__":
+    for name, value in check_float32().items():
+        print('{:>22}: {:.2e} (bound {:.0e})'.format(name, value, bound))
+    print('float32 check passed.')
@@ -0,0 +1,131 @@
+""" Module for resampling spectra with a precomputed linear operator.
+
+Spline interpolation is linear in the data, so resampling from a fixed axis onto another fixed axis
+can be written as a matrix product. The matrix is computed once from the interpolation of unit vectors,
+and the negligible weights far from the diagonal are dropped so that it can be stored as a sparse matrix.
+"""
+import numpy as np
+from scipy import interpolate, sparse
+
+
+def resampling_operator(x, x_new, kind='cubic', tol=1e-12, chunk=256):
+    """ Builds the linear operator equivalent to `scipy.interpolate.interp1d`.
+
+    The weights of a cubic spline decay geometrically (ratio 2-√3) with the distance from the
+    interpolation point, so dropping the weights smaller than `tol` keeps about 40 non-zero elements per row.
+    The deviation from `interp1d` is then below 3*`tol`*max(|y|).
+
+    Parameters
+    ----------
+    x : `1d-ndarray`, required
+        Original sampling axis. It does not need to be sorted.
+    x_new : `1d-ndarray`, required
+        Sampling axis after resampling. All values must be within the range of `x`.
+    kind : `str`
+        Data interpolation methods. For more information, see
+        https://docs.scipy.org/doc/scipy/reference/generated/scipy.interpolate.interp1d.html
+    tol : `float`
+        Weights whose absolute value is smaller than this are dropped.
+    chunk : `int`
+        Number of unit vectors interpolated at once (limits the temporary memory).
+
+    Returns
+    -------
+    operator : `scipy.sparse.csr_matrix`
+        (len(x_new), len(x)) matrix. `operator @ y` equals `interp1d(x, y, kind)(x_new)` within the tolerance.
+    """
+    blocks = []
+    for i in range(0, len(x), chunk):
+        unit = np.zeros((len(x), min(chunk, len(x)-i)))
+        unit[i:i+unit.shape[1]] = np.eye(unit.shape[1])
+        w = interpolate.interp1d(x, unit, kind, axis=0)(x_new)
+        w[np.abs(w) < tol] = 0
+        blocks.append(sparse.csc_matrix(w))
+    return sparse.hstack(blocks, format='csr')
+
+
+def apply_operator(operator, data, axis=0):
+    """ Applies a resampling operator along an axis of N-dimensional data in one call.
+
+    Parameters
+    ----------
+    operator : `scipy.sparse.spmatrix`, required
+        Operator built by `resampling_operator`.
+    data : `ndarray`, required
+        Data to be resampled.
+    axis : `int`
+        Axis of `data` that corresponds to the original sampling axis.
+
+    Returns
+    -------
+    `ndarray`
+        Resampled data. The length of `axis` becomes the number of rows of the operator.
+    """
+    data = np.moveaxis(np.asarray(data), axis, 0)
+    shape = data.shape
+    result = operator @ data.reshape(shape[0], -1)
+    return np.moveaxis(result.reshape((operator.shape[0],)+shape[1:]), 0, axis)
+
+
+def gather_operator(operator):
+    """ Converts a resampling operator to a gather form with the same number of weights for every row.
+
+    Row i of the result is Σ_k weights[k, i]·data[indices[k, i]]. Rows with fewer non-zero weights
+    are padded with zero weights, so the product can be evaluated with `apply_gathered` without temporary arrays.
+
+    Parameters
+    ----------
+    operator : `scipy.sparse.spmatrix`, required
+        Operator built by `resampling_operator`.
+
+    Returns
+    -------
+    indices : `2d-ndarray` (int)
+        (max non-zeros per row, rows) column indices.
+    weights : `2d-ndarray`
+        (max non-zeros per row, rows) weights.
+    """
+    operator = sparse.csr_matrix(operator)
+    counts = np.diff(operator.indptr)
+    width = max(int(counts.max()), 1)
+    indices = np.zeros((width, operator.shape[0]), dtype=np.intp)
+    weights = np.zeros((width, operator.shape[0]), dtype=operator.dtype)
+    rows = np.repeat(np.arange(operator.shape[0]), counts)
+    k = np.arange(operator.nnz) - np.repeat(operator.indptr[:-1], counts)  # Position within the row
+    indices[k, rows] = operator.indices
+    weights[k, rows] = operator.data
+    return indices, weights
+
+
+def apply_gathered(indices, weights, data, out, buffer):
+    """ Applies an operator in the gather form along axis0 without allocating memory.
+
+    Parameters
+    ----------
+    indices : `2d-ndarray`, required
+        Column indices returned by `gather_operator`.
+    weights : `ndarray`, required
+        Weights returned by `gather_operator`, reshaped to (k, rows, 1, ...) so that they broadcast against `out`.
+    data : `ndarray`, required
+        Data to be resampled (axis0 is the original sampling axis).
+    out : `ndarray`, required
+        Where the result is written. (rows,)+data.shape[1:]
+    buffer : `ndarray`, required
+        Work area of the same shape as `out`, or (k,)+out.shape to gather all the weights at once
+        (faster for small data, e.g. a single spectrum).
+
+    Returns
+    -------
+    `ndarray`
+        `out`
+    """
+    if buffer.shape == indices.shape+out.shape[1:]:
+        np.take(data, indices, axis=0, out=buffer, mode='clip')
+        np.multiply(buffer, weights, out=buffer)
+        return np.sum(buffer, axis=0, out=out)
+    out.fill(0)
+    for k in range(len(indices)):
+        np.take(data, indices[k], axis=0, out=buffer, mode='clip')  # 'clip' avoids an internal copy
+        np.multiply(buffer, weights[k], out=buffer)
+        np.add(out, buffer, out=out)
+    return out
@@ -0,0 +1,427 @@
+""" Module for pipelined step scans (the stage stops at each point while the spectra are measured).
+
+Measuring an A-line point by point with `read_spectra` and a blocking move (ret_form=0) adds up the exposure,
+the readout, the averaging and the serial round trip of the stage. In `StepScanner`, each spectrometer is read
+by its own acquisition thread into a ring buffer (`SpectraRing`), and the stage is moved without blocking:
+
+1. The stage has settled at a point: the spectra of all spectrometers are requested at the same time.
+2. As soon as the last frame has been acquired, the move to the next point is issued.
+3. While the stage moves, the frames are averaged and copied to the result arrays.
+4. The completion of the move is awaited.
+
+By default, the move is sent with ret_form=0 from a motion thread, so its reply marks the completion and a point
+costs one serial command. With poll=True, the move is sent with ret_form=1 and the completion is polled with
+`Crux.wait_position` (at least one more command per point).
+
+The exposure itself cannot overlap the motion (the spectra would be blurred), so a point takes
+max(measurement of each spectrometer) + motion instead of the sum of everything.
+
+`FlyScanner` does not stop at all: the horizontal stage sweeps the line continuously (`Crux.move_cont`) while the
+continuously scanning spectrometer streams frames. The position of each frame is interpolated from timestamped
+`read_position` samples, and the frames are resampled onto the grid of the scan.
+"""
+import time
+import threading
+import contextlib
+import concurrent.futures
+import numpy as np
+
+
+class SpectraRing:
+    """ Ring buffer of spectra filled by a dedicated acquisition thread.
+    """
+
+    def __init__(self, read, pixels, averaging=1, continuous=False, slots=64, into=False):
+        """ Initialization. The thread is started by `start` (or `with`).
+
+        Parameters
+        ----------
+        read : `callable`, required
+            Function that measures and returns one spectra (e.g. `ccs.read_spectra`).
+        pixels : `int`, required
+            Number of pixels of the spectra.
+        averaging : `int`
+            Number of frames averaged for each request (only for continuous=True).
+            For triggered spectrometers, pass the averaging to `read` instead.
+        continuous : `bool`
+            True : The spectrometer measures continuously (e.g. CCS175M after `start_scan`).
+                   The thread reads the frames all the time, and a request uses the frames started after it.
+            False : The measurement is started by `read` (e.g. PMA12). The thread reads once for each request.
+        slots : `int`
+            Number of frames kept in the ring buffer. Must be larger than `averaging`.
+        into : `bool`
+            If True, `read` writes the frame into the array it is given (e.g. `ccs.read_frame`),
+            so the frames are read out directly into the ring buffer without being copied.
+        """
+        if slots <= averaging:
+            raise ValueError("slots must be larger than averaging.")
+        self.__read = read
+        self.__frames = np.zeros((slots, pixels))
+        self.__stamps = np.zeros(slots)
+        self.__slots = slots
+        self.__averaging = averaging if continuous else 1
+        self.__continuous = continuous
+        self.__into = into
+        self.__written = 0  # Number of frames acquired
+        self.__requested = 0  # Number of frames requested (triggered mode)
+        self.__running = False
+        self.__error = None
+        self.__condition = threading.Condition()
+        self.__thread = None
+
+    def start(self):
+        """ Starts the acquisition thread.
+        """
+        self.__running = True
+        self.__error = None
+        self.__written = 0
+        self.__requested = 0
+        self.__thread = threading.Thread(target=self.__acquire, daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        """ Stops the acquisition thread after the current frame.
+        """
+        with self.__condition:
+            self.__running = False
+            self.__condition.notify_all()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def __acquire(self):
+        while True:
+            with self.__condition:
+                while self.__running and not self.__continuous and self.__requested == self.__written:
+                    self.__condition.wait()
+                if not self.__running:
+                    return
+            slot = self.__written % self.__slots  # Only this thread changes __written
+            try:
+                if self.__into:
+                    self.__read(self.__frames[slot])
+                else:
+                    frame = self.__read()
+            except Exception as e:  # Raised in the thread that collects the spectra
+                with self.__condition:
+                    self.__error = e
+                    self.__condition.notify_all()
+                return
+            stamp = time.perf_counter()
+            with self.__condition:
+                if not self.__into:
+                    self.__frames[slot] = frame
+                self.__stamps[slot] = stamp
+                self.__written += 1
+                self.__condition.notify_all()
+
+    def request(self):
+        """ Requests the spectra at the current position (the stage must be at rest).
+
+        Returns
+        -------
+        `int`
+            Ticket (index of the first frame) passed to `wait` and `collect`.
+        """
+        with self.__condition:
+            if self.__continuous:
+                return self.__written+1  # The frame being read may have been exposed during the motion
+            ticket = self.__requested
+            self.__requested += 1
+            self.__condition.notify_all()
+            return ticket
+
+    def wait(self, ticket, timeout=None):
+        """ Waits until all frames of the ticket have been acquired. After this, the stage may be moved.
+
+        Parameters
+        ----------
+        ticket : `int`, required
+            Return value of `request`.
+        timeout : `float`
+            Maximum waiting time [sec].
+        """
+        last = ticket+self.__averaging
+        with self.__condition:
+            if not self.__condition.wait_for(lambda: self.__written >= last or self.__error is not None, timeout):
+                raise TimeoutError("Spectra were not acquired within {} sec.".format(timeout))
+            if self.__written < last:
+                raise self.__error
+
+    def collect(self, ticket, out, timeout=None):
+        """ Writes the (averaged) spectra of the ticket to `out`.
+
+        Parameters
+        ----------
+        ticket : `int`, required
+            Return value of `request`.
+        out : `1d-ndarray`, required
+            Where the spectra are written.
+        timeout : `float`
+            Maximum waiting time [sec].
+
+        Returns
+        -------
+        `float`
+            Time (`time.perf_counter`) at which the last frame was acquired.
+        """
+        self.wait(ticket, timeout)
+        slots = np.arange(ticket, ticket+self.__averaging) % self.__slots
+        with self.__condition:
+            if self.__written-ticket >= self.__slots:  # The frame being read out is written to the slot of `ticket`
+                raise RuntimeError("Frames were overwritten before being collected. Increase slots.")
+            if self.__averaging == 1:
+                out[...] = self.__frames[slots[0]]
+            else:
+                np.mean(self.__frames[slots], axis=0, out=out)
+            return self.__stamps[slots[-1]]
+
+    def drain(self, start):
+        """ Copies all frames acquired since `start` (continuous mode).
+
+        Parameters
+        ----------
+        start : `int`
+            Index of the first frame (0 or the last return value).
+
+        Returns
+        -------
+        frames : `2d-ndarray`
+            Frames (one per row).
+        stamps : `1d-ndarray`
+            Times (`time.perf_counter`) at which the frames were acquired.
+        stop : `int`
+            Index of the next frame (pass it as `start` next time).
+        """
+        with self.__condition:
+            if self.__error is not None:
+                raise self.__error
+            stop = self.__written
+            if stop-start >= self.__slots:
+                raise RuntimeError("Frames were overwritten before being collected. Increase slots.")
+            slots = np.arange(start, stop) % self.__slots
+            return self.__frames[slots], self.__stamps[slots], stop
+
+
+class StepScanner:
+    """ Step scan with the stage motion and the readout of the spectrometers pipelined.
+    """
+
+    def __init__(self, stage, sources, velocity=9, interval=0.005, timeout=10., poll=False):
+        """ Initialization.
+
+        Parameters
+        ----------
+        stage : `Crux`, required
+            Sample stage.
+        sources : `list` of `SpectraRing`, required
+            Spectrometers measured at each point (not started yet; they are started for each scan).
+        velocity : `int`
+            Stage movement speed (1 to 9).
+        interval : `float`
+            Polling interval of the stage position [sec].
+        timeout : `float`
+            Maximum time for a move or a measurement [sec].
+        poll : `bool`
+            False : Moves are sent with ret_form=0 from a motion thread (one command per point).
+                    If a move times out, the scan is aborted without waiting for the motion thread,
+                    which is released by the reply timeout of the stage (`Crux(move_timeout=...)`).
+            True : Moves are sent with ret_form=1 and the completion is polled every `interval`.
+        """
+        self.__stage = stage
+        self.__sources = list(sources)
+        self.__velocity = velocity
+        self.__interval = interval
+        self.__timeout = timeout
+        self.__poll = poll
+        self.__motion = None  # Motion thread (poll=False)
+        self.__moving = None  # Future of the move in progress
+
+    def __send_move(self, h, v, previous, ret_form):
+        if v is None or (previous is not None and previous[1] == v):
+            self.__stage.absolute_move(h, axis_num=1, velocity=self.__velocity, ret_form=ret_form)
+        elif previous is not None and previous[0] == h:  # e.g. to the next row of a serpentine raster
+            self.__stage.absolute_move(v, axis_num=2, velocity=self.__velocity, ret_form=ret_form)
+        else:
+            self.__stage.biaxial_move(v=v, vmode='a', h=h, hmode='a', velocity=self.__velocity, ret_form=ret_form)
+
+    def __move(self, h, v, previous):
+        if self.__poll:
+            self.__send_move(h, v, previous, 1)
+        else:
+            self.__moving = self.__motion.submit(self.__send_move, h, v, previous, 0)
+
+    def __settle(self, h, v):
+        if not self.__poll:
+            try:
+                self.__moving.result(self.__timeout)
+            except concurrent.futures.TimeoutError:  # Not the built-in TimeoutError before Python 3.11
+                raise TimeoutError("Stage did not finish the move within {} sec.".format(self.__timeout)) from None
+            return
+        self.__stage.wait_position(h, axis_num=1, interval=self.__interval, timeout=self.__timeout)
+        if v is not None:
+            self.__stage.wait_position(v, axis_num=2, interval=self.__interval, timeout=self.__timeout)
+
+    def scan(self, trajectory, outs, progress=None):
+        """ Measures the spectra at each point.
+
+        Parameters
+        ----------
+        trajectory : `Trajectory`, required
+            Points in the order of measurement (see `scan_trajectory.line` and `scan_trajectory.raster`).
+        outs : `list` of `ndarray`, required
+            Where the spectra of each source are written. Shape is trajectory.shape+(pixels,).
+            The spectra are stored at the index of each point, so the order of measurement does not matter.
+        progress : `callable`
+            Called with 1 each time a point is finished (e.g. `tqdm.update`).
+        """
+        points = list(trajectory)
+        if self.__moving is not None and not self.__moving.done():
+            raise RuntimeError("The stage has not finished the move of the aborted scan.")
+        self.__motion = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        try:
+            self.__run(points, outs, progress)
+        except BaseException:
+            self.__motion.shutdown(wait=False, cancel_futures=True)  # The move in progress may never return
+            raise
+        self.__motion.shutdown()
+
+    def __run(self, points, outs, progress):
+        with contextlib.ExitStack() as stack:
+            for source in self.__sources:
+                stack.enter_context(source)
+            self.__move(points[0][0], points[0][1], None)
+            self.__settle(points[0][0], points[0][1])
+            for k, (x, y, index) in enumerate(points):
+                tickets = [source.request() for source in self.__sources]
+                for source, ticket in zip(self.__sources, tickets):
+                    source.wait(ticket, self.__timeout)
+                following = points[k+1] if k+1 < len(points) else None
+                if following is not None:  # The stage moves while the spectra are stored
+                    self.__move(following[0], following[1], (x, y))
+                for source, ticket, out in zip(self.__sources, tickets, outs):
+                    source.collect(ticket, out[index])
+                if progress is not None:
+                    progress(1)
+                if following is not None:
+                    self.__settle(following[0], following[1])
+
+
+class FlyScanner:
+    """ Line scan with the horizontal stage moving continuously.
+    """
+
+    def __init__(self, stage, source, velocity=0, positive_way=0, margin=200, latency=0., timeout=60.):
+        """ Initialization.
+
+        Parameters
+        ----------
+        stage : `Crux`, required
+            Sample stage.
+        source : `SpectraRing`, required
+            Continuously scanning spectrometer (continuous=True). Its `slots` must hold the frames
+            acquired during one polling cycle of the stage position (one serial round trip).
+        velocity : `int`
+            Stage speed of `Crux.move_cont`. The speed must be low enough that at least one frame is
+            acquired per grid step; otherwise the missing points are interpolated from the neighbours.
+        positive_way : `int`
+            Rotation way (`rot_way` of `Crux.move_cont`) that increases the pulse counter.
+        margin : `int`
+            Run-up distance [pulse] before the first point and after the last one, so that the stage moves
+            at a constant speed over the line.
+        latency : `float`
+            Time from the middle of the exposure to the reception of a frame [sec].
+            Subtracted from the timestamps (about the integration time/2 + the readout time).
+        timeout : `float`
+            Maximum time of a sweep [sec].
+        """
+        self.__stage = stage
+        self.__source = source
+        self.__velocity = velocity
+        self.__positive_way = positive_way
+        self.__margin = margin
+        self.__latency = latency
+        self.__timeout = timeout
+
+    def __sweep(self, start, end):
+        """ Sweeps from `start` to `end` and returns the frames with their (interpolated) positions.
+        """
+        direction = 1 if end > start else -1
+        self.__stage.absolute_move(start, axis_num=1)
+        frames, stamps, times, positions = [], [], [], []
+        index = 0
+        with self.__source as source:
+            times.append(time.perf_counter())  # At rest until the sweep starts
+            positions.append(start)
+            self.__stage.move_cont(self.__positive_way if direction > 0 else 1-self.__positive_way, axis_num=1, velocity=self.__velocity)
+            deadline = time.monotonic()+self.__timeout
+            try:
+                while True:
+                    before = time.perf_counter()
+                    position = self.__stage.read_position(1)
+                    times.append((before+time.perf_counter())/2)
+                    positions.append(position)
+                    chunk, stamp, index = source.drain(index)
+                    frames.append(chunk)
+                    stamps.append(stamp)
+                    if (position-end)*direction >= 0:
+                        break
+                    if (position-start)*direction < -self.__margin:
+                        raise RuntimeError("The stage moves in the wrong direction. Check positive_way.")
+                    if time.monotonic() > deadline:
+                        raise RuntimeError("The sweep did not finish within {} sec.".format(self.__timeout))
+            finally:
+                self.__stage.stop(axis_num=1)
+        frames = np.concatenate(frames)
+        stamps = np.concatenate(stamps)-self.__latency
+        inside = (stamps >= times[0]) & (stamps <= times[-1])  # Frames whose position is bracketed by samples
+        return frames[inside], np.interp(stamps[inside], times, positions)
+
+    def scan(self, h, out):
+        """ Measures a line and resamples it onto the grid `h`.
+        Frames within half a step of a point are averaged, and the points without frames are linearly interpolated.
+
+        Parameters
+        ----------
+        h : `1d-ndarray` of `int`, required
+            Evenly spaced absolute horizontal positions [pulse] of the points, in the order of measurement.
+        out : `2d-ndarray`, required
+            Where the spectra are written. Shape is (len(h), pixels).
+
+        Returns
+        -------
+        `int`
+            Number of frames used.
+        """
+        h = np.asarray(h)
+        step = (h[-1]-h[0])/(len(h)-1)
+        direction = 1 if step > 0 else -1
+        frames, positions = self.__sweep(int(h[0])-direction*self.__margin, int(h[-1])+direction*self.__margin)
+        grid = (positions-h[0])/step  # Position in units of points
+        order = np.argsort(grid, kind='stable')
+        frames, grid = frames[order], grid[order]
+        if len(grid) < 2 or grid[0] > 0 or grid[-1] < len(h)-1:
+            raise RuntimeError("The frames do not cover the line. Increase margin or slow down the stage.")
+        cell = np.rint(grid).astype(int)
+        used = (cell >= 0) & (cell < len(h))
+        counts = np.bincount(cell[used], minlength=len(h))
+        filled = np.flatnonzero(counts)
+        starts = np.searchsorted(cell, filled)  # The frames of each cell are contiguous after sorting
+        out[filled] = np.add.reduceat(frames, starts, axis=0)
+        # reduceat sums up to the next start, so the last cell would include the frames beyond the line
+        last = filled[-1]
+        out[last] = frames[starts[-1]:starts[-1]+counts[last]].sum(axis=0)
+        out[filled] /= counts[filled, np.newaxis]
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            upper = np.clip(np.searchsorted(grid, empty), 1, len(grid)-1)
+            weight = ((empty-grid[upper-1])/(grid[upper]-grid[upper-1]))[:, np.newaxis]
+            out[empty] = frames[upper-1]*(1-weight)+frames[upper]*weight
+        return int(np.sum(used))
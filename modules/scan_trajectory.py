@@ -0,0 +1,89 @@
+""" Module for the trajectories of the sample stage in step scans.
+
+A trajectory is the list of points in the order of measurement. Each point has the absolute stage positions
+and the index where its spectra are stored, so the stored data is always in the canonical order
+(row i = i-th vertical position, column j = j-th horizontal position) whatever the order of measurement.
+
+With a serpentine (boustrophedon) raster, the odd rows are measured from the end to the start,
+so the horizontal stage does not have to return to the start of the line (flyback) after each row.
+The positions are identical, but an odd row is approached from the other side, so a backlash of the stage
+appears as a shift between even and odd rows.
+"""
+import numpy as np
+
+
+class Trajectory:
+    """ Points of a step scan in the order of measurement.
+    """
+
+    def __init__(self, h, v, indices, shape):
+        """ Initialization. Use `line` or `raster` to create a trajectory.
+
+        Parameters
+        ----------
+        h : `1d-ndarray` of `int`, required
+            Absolute horizontal positions [pulse] in the order of measurement.
+        v : `1d-ndarray` of `int` or `None`, required
+            Absolute vertical positions [pulse] in the order of measurement. `None` if the vertical stage is not moved.
+        indices : `list` of `tuple`, required
+            Where the spectra of each point are stored.
+        shape : `tuple`, required
+            Shape of the scan.
+        """
+        self.h = np.asarray(h, dtype=int)
+        self.v = None if v is None else np.asarray(v, dtype=int)
+        self.indices = list(indices)
+        self.shape = tuple(shape)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __iter__(self):
+        """ Yields (horizontal position, vertical position or `None`, index) of each point.
+        """
+        for k, index in enumerate(self.indices):
+            yield int(self.h[k]), None if self.v is None else int(self.v[k]), index
+
+
+def line(h):
+    """ Line scan with the horizontal stage.
+
+    Parameters
+    ----------
+    h : `1d-ndarray` of `int`, required
+        Absolute horizontal positions [pulse] in the order of measurement.
+
+    Returns
+    -------
+    `Trajectory`
+        Spectra of the j-th point are stored in out[j].
+    """
+    h = np.asarray(h)
+    return Trajectory(h, None, [(j,) for j in range(len(h))], (len(h),))
+
+
+def raster(h, v, serpentine=True):
+    """ Raster scan (rows along the horizontal axis).
+
+    Parameters
+    ----------
+    h : `1d-ndarray` of `int`, required
+        Absolute horizontal positions [pulse] of the columns.
+    v : `1d-ndarray` of `int`, required
+        Absolute vertical positions [pulse] of the rows.
+    serpentine : `bool`
+        True : The odd rows are measured in the reverse direction (no flyback).
+        False : All rows are measured from h[0] to h[-1] (the stage returns to h[0] after each row).
+
+    Returns
+    -------
+    `Trajectory`
+        Spectra of the point (v[i], h[j]) are stored in out[i, j] in both cases.
+    """
+    h, v = np.asarray(h), np.asarray(v)
+    columns = np.tile(np.arange(len(h)), (len(v), 1))
+    if serpentine:
+        columns[1::2] = columns[1::2, ::-1]
+    rows = np.repeat(np.arange(len(v)), len(h))
+    columns = columns.ravel()
+    return Trajectory(h[columns], v[rows], list(zip(rows.tolist(), columns.tolist())), (len(v), len(h)))
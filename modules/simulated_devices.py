@@ -0,0 +1,524 @@
+""" Module for simulated devices with the same public interfaces as the drivers.
+
+The drivers need the DLLs of the manufacturers (Windows) or the serial ports of the bench.
+The classes here can be used instead (see `devices`) to run the measurement programs anywhere,
+e.g. to profile the acquisition loop on a Linux machine.
+
+- `Crux` / `Fine01r` : Stages. Every command takes `serial_latency` [sec] (serial round trip), and the position
+  moves at the speed selected by `velocity`, so non-blocking moves and polling behave like the real stage.
+- `Ccs175m` : Continuously scanning spectrometer. The frames are produced at the rate given by the
+  integration time, with the interference of the reference mirror and a layered sample (`layers`).
+  The sample is tilted, so B-scans show the position of the stage.
+- `Pma12` : Spectrometer for the absorbance measurement. The sample has two regions with different colors
+  (left and right of the origin of the horizontal stage).
+- `ArtCam130` : Camera of the beam profiler (beam spot with noise).
+
+The stages and the spectrometers share the state of the bench, so a spectra depends on where the stage is
+at the time of the exposure. The sample can be changed with the environment variable OCT_SIMULATE_LAYERS
+(e.g. '0.05:0.02,0.12:0.01' = depth [mm]:reflectance of each interface) and the latency of the serial
+commands with OCT_SIMULATE_LATENCY [sec].
+"""
+import os
+import time
+import threading
+import numpy as np
+try:
+    from modules.latency import LatencyHistogram
+except ImportError:  # When executed in the modules directory
+    from latency import LatencyHistogram
+
+
+def _layers():
+    value = os.environ.get('OCT_SIMULATE_LAYERS')
+    if not value:
+        return [(0.05, 0.02), (0.12, 0.01), (0.20, 0.005)]
+    return [tuple(float(v) for v in layer.split(':')) for layer in value.split(',')]
+
+
+layers = _layers()  # (depth [mm], reflectance) of each interface of the sample
+refractive_index = 1.5  # Refractive index of the sample
+tilt = 0.02  # Change of the depth of the sample per horizontal distance [mm/mm]
+pl_rate = 2000  # Number of pulses equals to 1mm [pulse/mm]
+serial_latency = float(os.environ.get('OCT_SIMULATE_LATENCY', 0.02))  # Round trip of a CRUX command [sec]
+
+_bench = {'stage': None, 'mirror': None}  # Simulated devices that change the spectra
+_rng = np.random.default_rng()
+
+
+def _stage_position(t):
+    """ Position [pulse] of the sample stage (horizontal, vertical) at time `t` (`time.perf_counter`).
+    """
+    stage = _bench['stage']
+    return (0., 0.) if stage is None else stage.position_at(t)
+
+
+class _Axis:
+    """ Motion of one axis of a stage (constant speed, no acceleration).
+    """
+
+    def __init__(self):
+        self.start = 0.
+        self.target = 0.
+        self.t0 = 0.
+        self.speed = 0.
+        self.way = 0  # +1 / -1 while moving continuously
+
+    def position(self, t):
+        if self.way:
+            return self.start+self.way*self.speed*(t-self.t0)
+        distance = self.target-self.start
+        travelled = max(t-self.t0, 0.)*self.speed
+        if travelled >= abs(distance):
+            return self.target
+        return self.start+np.sign(distance)*travelled
+
+    def move(self, target, speed, t):
+        self.start = self.position(t)
+        self.way = 0
+        self.target = float(target)
+        self.speed = speed
+        self.t0 = t
+        return t+abs(self.target-self.start)/speed  # Completion time
+
+    def move_cont(self, way, speed, t):
+        self.start = self.position(t)
+        self.way = way
+        self.speed = speed
+        self.t0 = t
+
+    def stop(self, t):
+        self.start = self.target = self.position(t)
+        self.way = 0
+
+
+class CcsError(Exception):
+    """ Same as `ccs175m.CcsError`.
+    """
+
+    def __init__(self, status_code=None, session=None, msg="See terminal for details."):
+        self.__msg = '\033[31m' + msg + '\033[0m'
+
+    def __str__(self):
+        return self.__msg
+
+
+class Ccs175m():
+    """ Simulated compact spectrometer (CCS175/M).
+    """
+    num_pixels = 3648  # number of effective pixels of CCD
+    readout_time = 4e-3  # Time to read out a frame [sec]
+    center = 840.  # Center wavelength of the light source [nm]
+    bandwidth = 40.  # FWHM of the light source [nm]
+    noise = 1e-3  # Standard deviation of the noise (full scale = 1)
+
+    def __init__(self, name: str):
+        self.__wavelength = np.linspace(500., 1000., Ccs175m.num_pixels)
+        k = 2*np.pi/(self.__wavelength*1e-6)  # Wave number [1/mm]
+        self.__k = k
+        self.__source = np.exp(-4*np.log(2)*((self.__wavelength-Ccs175m.center)/Ccs175m.bandwidth)**2)
+        self.__integration = 1e-2
+        self.__t0 = None
+        self.__last = -1
+        self.__lock = threading.Lock()
+        self.frame_count = 0
+        self.timestamp = None
+        print('CCS175M is ready. (simulated)')
+
+    @property
+    def wavelength(self):
+        """ Wavelength [nm] axis corresponding to the measurement data.
+        """
+        return self.__wavelength
+
+    def set_IntegrationTime(self, time=1.0e-3):
+        """ Sets the integration time [sec]. The intensity is proportional to it.
+        """
+        if not 1.0e-5 <= time <= 6.0e+1:
+            raise CcsError(msg="Invalid integration time.")
+        self.iTime = time
+        self.__integration = time
+        self.__t0 = None  # Scanning stops
+
+    def start_scan(self):
+        """ Starts measurement continuously.
+        """
+        self.__t0 = time.perf_counter()
+        self.__last = -1
+
+    def __frame(self, t):
+        """ Spectra exposed at time `t`.
+        """
+        h, v = _stage_position(t)
+        mirror = _bench['mirror']
+        offset = 0. if mirror is None else mirror.position*1e-6  # Reference mirror [nm] -> [mm]
+        interference = np.ones_like(self.__k)
+        for depth, reflectance in layers:
+            z = depth+tilt*h/pl_rate+offset
+            interference += reflectance+2*np.sqrt(reflectance)*np.cos(2*self.__k*refractive_index*z)
+        data = 0.4*self.__integration/1e-4*self.__source*interference
+        return data+_rng.normal(0., Ccs175m.noise, data.shape)
+
+    def __next_frame(self, out):
+        """ Waits for the next frame of the continuous scan and writes it into `out`.
+        """
+        if self.__t0 is None:
+            raise CcsError(msg="CcsError:Scan is not started.")
+        period = self.__integration+Ccs175m.readout_time
+        with self.__lock:
+            index = max(self.__last+1, int((time.perf_counter()-self.__t0)/period)-1)
+            self.__last = index
+        end = self.__t0+(index+1)*period
+        time.sleep(max(end-time.perf_counter(), 0.))
+        out[:] = self.__frame(end-period/2)
+        self.frame_count += 1
+        self.timestamp = time.perf_counter()
+
+    def read_frame(self, out):
+        """ Reads out one frame into `out` (see `ccs175m.Ccs175m.read_frame`).
+        """
+        self.__next_frame(out)
+        if out.max() >= 1:
+            raise CcsError(status_code=None, session=None, msg="CcsError:Measured data are saturated.")
+        return self.timestamp
+
+    def read_spectra(self, averaging: int = 1, out=None):
+        """ Reads out spectra (waits for the next frames of the continuous scan).
+        """
+        block = np.zeros((averaging, Ccs175m.num_pixels))
+        for i in range(averaging):
+            self.__next_frame(block[i])
+        if block.max() >= 1:
+            raise CcsError(status_code=None, session=None, msg="CcsError:Measured data are saturated.")
+        if out is None:
+            out = np.empty(Ccs175m.num_pixels)
+        return np.mean(block, axis=0, out=out)
+
+    def close_ccs(self):
+        """ Terminates the (simulated) connection.
+        """
+        self.__t0 = None
+
+    def output_ErrorMessage(self, status_code, session):
+        return None
+
+
+class PmaError(Exception):
+    """ Same as `pma12.PmaError`.
+    """
+
+    def __init__(self, msg: str):
+        self.msg = '\033[31m' + msg + '\033[0m'
+
+    def __str__(self):
+        return self.msg
+
+
+class Pma12():
+    """ Simulated multichannel spectrometer (PMA-12).
+    """
+    correction_data = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tools', '320016.sc')  # Wavelength and sensitivity
+    dark = 1000.  # Dark counts
+    full_scale = 8000.  # Counts of the lamp (corrected) at the standard exposure time
+
+    def __init__(self, dev_id: int):
+        try:
+            ref = np.loadtxt(Pma12.correction_data)
+        except OSError:  # Typical values
+            ref = np.column_stack([np.linspace(197., 961., 1024), np.ones(1024)])
+        self.__wavelength = ref[:, 0]
+        self.__sensitivity = ref[:, 1]
+        planck = 1/(self.__wavelength**5*(np.exp(1.4388e7/(self.__wavelength*3000.))-1))  # Halogen lamp (3000 K)
+        self.__lamp = planck/planck.max()
+        self.dev_id = dev_id
+        self.set_parameter()
+        self.__background = self.read_spectra(correction=False)
+        print("PMA12 is ready. (simulated)")
+
+    @property
+    def wavelength(self):
+        """ Wavelength [nm] axis corresponding to the measurement data.
+        """
+        return self.__wavelength
+
+    def set_parameter(self, trigger_mode=0, start_mode=0, trigger_polarity=0,
+                      shutter=0, ii=0, ii_gain=0, amp_gain=3,
+                      exposure_time=19, delay_time=0, pixel_clock_time=4):
+        """ Sets the measurement conditions (only the shutter and the exposure time are simulated).
+        """
+        if shutter not in [0, 1] or exposure_time < 19 or exposure_time > 65535:
+            raise PmaError(msg="Invalid parameters were set.")
+        self.__shutter = shutter
+        self.__exposure = exposure_time
+
+    def __reflectance(self, h):
+        """ Reflectance of the sample at the horizontal position `h` [pulse] (red | blue cellophane).
+        """
+        edge = 600. if h < 0 else 500.
+        band = 1/(1+np.exp((self.__wavelength-edge)/15.))
+        return 0.9-0.7*band if h < 0 else 0.2+0.7*band
+
+    def read_spectra(self, correction=True, averaging=1):
+        """ Starts measurement and reads out spectra.
+        """
+        data = np.zeros((averaging, self.__wavelength.size))
+        for i in range(averaging):
+            time.sleep(self.__exposure*1e-3)
+            h, v = _stage_position(time.perf_counter()-self.__exposure*5e-4)
+            signal = Pma12.full_scale*self.__exposure/19*self.__lamp*self.__reflectance(h)/self.__sensitivity
+            counts = Pma12.dark+self.__shutter*signal
+            data[i] = np.minimum(np.rint(counts+_rng.normal(0., np.sqrt(counts))), 65535)
+        if correction:
+            if data.max() >= 65535:
+                raise PmaError(msg="PmaError:Measured data are saturated.")
+            data = data - self.__background
+            data = np.where(data < 0, 0, data)*self.__sensitivity
+        return np.mean(data, axis=0)
+
+    def close(self) -> bool:
+        self.set_parameter()
+
+
+class CruxError(Exception):
+    """ Same as `crux.CruxError`.
+    """
+
+    def __init__(self, msg: str):
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
+class Crux:
+    """ Simulated 2-axis auto stage (CRUX).
+    """
+    speeds = (500, 1000, 2000, 4000, 6000, 8000, 10000, 15000, 20000)  # Speed [pulse/sec] of each velocity (1 to 9)
+
+    def __init__(self, port: str, baudrate=9600, timeout=10., move_timeout=300., latency=None):
+        self.command_latency = serial_latency if latency is None else latency
+        self.__move_timeout = move_timeout
+        self.latency = LatencyHistogram()
+        self.__axes = {1: _Axis(), 2: _Axis()}
+        self.__mpi = {1: None, 2: None}
+        self.__lock = threading.Lock()
+        self.hw_info = self.read_hw_info()
+        _bench['stage'] = self
+        self.move_origin()
+        print("CRUX is ready. (simulated)")
+
+    @staticmethod
+    def format_cmd(cmd: str, param=[]):
+        """ Format the command string (same as `crux.Crux.format_cmd`).
+        """
+        return ('\2'+cmd+'/'.join(str(p) for p in param)+'\r\n').encode('ascii')
+
+    def __speed(self, velocity):
+        if not 0 <= velocity <= 9:
+            raise CruxError(msg='Error returned from device. See error code and manual(pp.60-61) for details.\nError Code:velocity\n')
+        return Crux.speeds[max(velocity, 1)-1]
+
+    def __command(self, cmd, action=None, ret_form=1):
+        """ Simulates the round trip of a command. `action(now)` is executed on the device and returns
+        the completion time of the operation (ret_form=0 waits for it).
+        """
+        start = time.perf_counter()
+        time.sleep(self.command_latency/2)
+        with self.__lock:
+            now = time.perf_counter()
+            result = None if action is None else action(now)
+        time.sleep(self.command_latency/2)
+        if ret_form == 0 and result is not None:
+            if result-time.perf_counter() > self.__move_timeout:
+                time.sleep(self.__move_timeout)
+                raise CruxError(msg='No reply from CRUX within {} sec.'.format(self.__move_timeout))
+            time.sleep(max(result-time.perf_counter(), 0.))
+        self.latency.record(cmd, time.perf_counter()-start)
+        return result
+
+    def __moves(self, moves):
+        return lambda now: max(self.__axes[axis].move(target, speed, now) for axis, target, speed in moves)
+
+    def position_at(self, t):
+        """ Positions [pulse] (horizontal, vertical) at time `t` (`time.perf_counter`).
+        """
+        with self.__lock:
+            return self.__axes[1].position(t), self.__axes[2].position(t)
+
+    def read_hw_info(self):
+        self.__command('IDN')
+        return ['C', 'IDN', 'CRUX', '1000']
+
+    def move_origin(self, axis_num=0, velocity=9, ret_form=0):
+        for axis in ((1, 2) if axis_num == 0 else (axis_num,)):
+            self.__command('ORG', self.__moves([(axis, 0, self.__speed(velocity))]), 0 if axis_num == 0 else ret_form)
+
+    def absolute_move(self, position: int, axis_num=1, velocity=9, ret_form=0):
+        self.__command('APS', self.__moves([(axis_num, position, self.__speed(velocity))]), ret_form)
+
+    def biaxial_move(self, v: int, vmode: str, h: int, hmode: str, velocity=9, ret_form=0):
+        if hmode not in ('a', 'r'):
+            raise CruxError(msg='Invalid value was set to hmode.')
+        if vmode not in ('a', 'r'):
+            raise CruxError(msg='Invalid value was set to vmode.')
+        for axis, mode in ((1, hmode), (2, vmode)):
+            if self.__mpi[axis] != (mode, velocity):  # Same cache as `crux.Crux`
+                self.__command('MPI')
+                self.__mpi[axis] = (mode, velocity)
+        speed = self.__speed(velocity)
+        targets = [(1, h, hmode), (2, v, vmode)]
+        self.__command('MPS', lambda now: max(self.__axes[axis].move(
+            target if mode == 'a' else self.__axes[axis].target+target, speed, now) for axis, target, mode in targets), ret_form)
+
+    def relative_move(self, distance: int, axis_num=1, velocity=9, ret_form=0):
+        axis = self.__axes[axis_num]
+        self.__command('RPS', lambda now: axis.move(axis.target+distance, self.__speed(velocity), now), ret_form)
+
+    def read_position(self, axis_num: int):
+        return int(self.__command('RDP', lambda now: self.__axes[axis_num].position(now)))
+
+    def position(self, axis_num: int, verify=False):
+        """ Position after the issued moves (see `crux.Crux.position`).
+        """
+        if verify:
+            return self.read_position(axis_num)
+        return int(self.__axes[axis_num].target) if not self.__axes[axis_num].way else self.read_position(axis_num)
+
+    def wait_position(self, position: int, axis_num=1, interval=0.005, timeout=10.):
+        deadline = time.monotonic()+timeout
+        while True:
+            current = self.read_position(axis_num)
+            if current == position:
+                return
+            if time.monotonic() > deadline:
+                raise CruxError(msg='Stage did not reach the target position.(axis:{}, target:{}, current:{})'.format(axis_num, position, current))
+            time.sleep(interval)
+
+    def move_cont(self, rot_way: int, axis_num=1, velocity=0):
+        speed = self.__speed(velocity)
+        self.__command('FRP', lambda now: self.__axes[axis_num].move_cont(1 if rot_way == 0 else -1, speed, now))
+
+    def stop(self, axis_num=1, stop_mode=0):
+        def action(now):
+            for axis in ((1, 2) if axis_num == 0 else (axis_num,)):
+                self.__axes[axis].stop(now)
+        self.__command('STP', action)
+
+    def close(self):
+        self.move_origin()
+
+
+class Fine01rError(Exception):
+    """ Same as `fine01r.Fine01rError`.
+    """
+
+    def __init__(self, msg: str):
+        self.msg = '\033[31m' + msg + '\033[0m'
+
+    def __str__(self):
+        return self.msg
+
+
+class Fine01r:
+    """ Simulated piezo stage (FINE-01r) of the reference mirror. The position [nm] shifts the reference arm.
+    """
+    latency = 0.005  # Round trip of a command at 38400 baud [sec]
+
+    def __init__(self, port: str, baudrate=38400, delimiter='\r\n'):
+        self.position = 0
+        self.__hw_info = {'device_name': 'FINE-01r', 'firmware_version': 'simulated'}
+        _bench['mirror'] = self
+        print("FINE-01r is ready. (simulated)")
+
+    @property
+    def hw_info(self):
+        return self.__hw_info
+
+    @property
+    def status(self):
+        time.sleep(Fine01r.latency)
+        return {'position': self.position, 'cmd_success': True, 'Stop': True, 'cmd_permission': True}
+
+    def sendreceive(self, cmd: str):
+        time.sleep(Fine01r.latency)
+        return 'OK'
+
+    def read_hw_info(self):
+        return self.__hw_info
+
+    def absolute_move(self, position: int):
+        time.sleep(2*Fine01r.latency)
+        self.position = position
+        return 'OK'
+
+    def stop(self):
+        self.position = 0
+        return self.sendreceive('L:E')
+
+    def close(self):
+        self.absolute_move(0)
+
+
+class ArtCamError(Exception):
+    """ Same as `artcam130mi.ArtCamError`.
+    """
+
+    def __init__(self, msg: str):
+        self.msg = '\033[31m' + msg + '\033[0m'
+
+    def __str__(self):
+        return self.msg
+
+
+class ArtCam130():
+    """ Simulated CMOS camera (ARTCAM-130MI-BW) observing the beam spot.
+    """
+    frame_rate = 30.  # Frames per second
+
+    def __init__(self, exposure_time, scale=1.0, auto_iris=0,
+            h_total=1280, h_start=0, h_effective=1280, v_total=1024, v_start=0, v_effective=1024):
+        self.__capturing = False
+        self.set_parameter(exposure_time, scale, auto_iris, h_total, h_start, h_effective, v_total, v_start, v_effective)
+        print("ArtCam130 is ready. (simulated)")
+
+    @property
+    def raw_image(self):
+        """ Unprocessed image (data immediately after capture).
+        """
+        return self.__img
+
+    def set_parameter(self, exposure_time, scale=1.0, auto_iris=0,
+            h_total=1280, h_start=0, h_effective=1280, v_total=1024, v_start=0, v_effective=1024):
+        self.__img = np.zeros((v_effective, h_effective), dtype=np.uint8)
+        self.__scale = scale
+        self.__exposure = exposure_time
+        y, x = np.mgrid[v_start:v_start+v_effective, h_start:h_start+h_effective]
+        r2 = (x-h_total/2)**2+(y-v_total/2)**2
+        self.__spot = np.exp(-2*r2/80.**2)  # Gaussian beam (1/e^2 radius 80 pixels)
+        shape = (int(v_effective*scale), int(h_effective*scale))
+        self.__rows = (np.arange(shape[0])/scale).astype(int)  # Nearest neighbour resize
+        self.__columns = (np.arange(shape[1])/scale).astype(int)
+        self.__grid = np.zeros(shape+(3,), dtype=np.uint8)
+        self.__grid[shape[0]//2, :, 1] = 127  # Horizontal center line
+        self.__grid[:, shape[1]//2, 1] = 127  # Vertical center line
+
+    def open(self):
+        self.__capturing = True
+
+    def capture(self, grid=False):
+        if not self.__capturing:
+            raise ArtCamError(msg="Failed to capture.")
+        time.sleep(1/ArtCam130.frame_rate)
+        level = 200*min(self.__exposure/500, 1.27)
+        self.__img[:] = np.clip(level*self.__spot+_rng.normal(5., 2., self.__spot.shape), 0, 255).astype(np.uint8)
+        img = self.__img[self.__rows][:, self.__columns]
+        if grid:
+            img = np.repeat(img[..., np.newaxis], 3, axis=2)
+            mask = self.__grid.any(axis=2)
+            img[mask] = self.__grid[mask]
+        return img
+
+    def close(self):
+        self.__capturing = False
+
+    def release(self) -> bool:
+        self.__capturing = False
@@ -0,0 +1,150 @@
+""" Module for caching precomputed tables (e.g. sine wave data sets) on disk.
+
+Tables are stored as .npy files named after a hash of the parameters used to compute them,
+so they can be memory-mapped on the next launch instead of being recomputed.
+The total size of the cache directory is bounded, and the least recently used tables are deleted first.
+"""
+import os
+import glob
+import hashlib
+import tempfile
+import numpy as np
+
+
+class TableCache:
+    """ Content-addressed, size-bounded cache of 2-dimensional tables.
+    """
+    default_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tools', 'cache')  # Default cache directory
+    default_max_size = 1024  # Default upper limit of the total size of the cache [MB].
+
+    def __init__(self, directory=None, max_size=None):
+        """ Initialization of the cache directory.
+
+        Parameters
+        ----------
+        directory : `str`
+            Where the tables are stored. If not specified, `modules/tools/cache` is used.
+        max_size : `float`
+            Upper limit of the total size of the cache [MB].
+            When it is exceeded, the least recently used tables are deleted.
+        """
+        self.__dir = TableCache.default_directory if directory is None else directory
+        self.__max_size = TableCache.default_max_size if max_size is None else max_size
+
+    @property
+    def directory(self):
+        """ Where the tables are stored.
+        """
+        return self.__dir
+
+    @staticmethod
+    def make_key(*params):
+        """ Generates a key that identifies a table from the parameters used to compute it.
+
+        Parameters
+        ----------
+        params : `ndarray`, `float`, `int`, `str`
+            Parameters of the table. Arrays are hashed by their dtype, shape and contents.
+
+        Return
+        -------
+        key : `str`
+            Hexadecimal digest of the parameters.
+        """
+        h = hashlib.sha1()
+        for p in params:
+            if isinstance(p, np.ndarray):
+                p = np.ascontiguousarray(p)
+                h.update('{}{}'.format(p.dtype.str, p.shape).encode('ascii'))
+                h.update(p.tobytes())
+            else:
+                h.update(repr(p).encode('utf-8'))
+            h.update(b'|')
+        return h.hexdigest()
+
+    def __path(self, key):
+        return os.path.join(self.__dir, key+'.npy')
+
+    def load(self, key):
+        """ Reads a table from the cache.
+
+        Parameters
+        ----------
+        key : `str`, required
+            Key generated by `make_key`.
+
+        Return
+        -------
+        `ndarray` or `None`
+            Read-only memory-mapped table. If the table is not cached (or is broken), `None` is returned.
+        """
+        path = self.__path(key)
+        try:
+            table = np.load(path, mmap_mode='r')
+            os.utime(path)  # Mark as recently used
+        except (OSError, ValueError):
+            return None
+        return table
+
+    def store(self, key, table):
+        """ Writes a table to the cache and deletes old tables if the cache is full.
+        Failure to write (e.g. read-only directory) is not an error; the table is simply not cached.
+
+        Parameters
+        ----------
+        key : `str`, required
+            Key generated by `make_key`.
+        table : `ndarray`, required
+            Table to be stored.
+
+        Return
+        -------
+        `bool`
+            Whether the table was stored.
+        """
+        if table.nbytes > self.__max_size*2**20:
+            return False
+        tmp = None
+        try:
+            os.makedirs(self.__dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.__dir)
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, table)
+            os.replace(tmp, self.__path(key))  # Atomic, so other processes never see a partial file
+        except OSError:
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+            return False
+        self.evict(keep=key)
+        return True
+
+    def evict(self, keep=None):
+        """ Deletes the least recently used tables until the total size is within the limit.
+
+        Parameters
+        ----------
+        keep : `str`
+            Key of a table that must not be deleted (normally the one just stored).
+        """
+        files = []
+        for path in glob.glob(os.path.join(self.__dir, '*.npy')):
+            try: stat = os.stat(path)
+            except OSError: continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+        total = sum(f[1] for f in files)
+        for _, size, path in files:
+            if total <= self.__max_size*2**20:
+                break
+            if keep is not None and path == self.__path(keep):
+                continue
+            try: os.remove(path)
+            except OSError: continue  # Still mapped by another process (Windows)
+            total -= size
+
+    def clear(self):
+        """ Deletes all cached tables.
+        """
+        for path in glob.glob(os.path.join(self.__dir, '*.npy')):
+            try: os.remove(path)
+            except OSError: pass
@@ -6,15 +6,13 @@ import cv2
 import matplotlib.pyplot as plt
 from matplotlib.ticker import ScalarFormatter
 from tqdm import tqdm
-from modules.pma12 import Pma12, PmaError
-from modules.fine01r import Fine01r, Fine01rError
+from modules.devices import Pma12, PmaError, Fine01r, Fine01rError, Crux, CruxError, ArtCam130, Ccs175m, CcsError  # Simulated if OCT_SIMULATE is set
 #from modules.ncm6212c import Ncm6212c, Ncm6212cError
-from modules.crux import Crux,CruxError
-from modules.artcam130mi import ArtCam130
 from modules.signal_processing_hamasaki import SignalProcessorHamasaki as Processor
 from modules.signal_processing_hamasaki import calculate_absorbance 
 import modules.data_handler as dh
-from modules.ccs175m import Ccs175m,CcsError
+from modules import scan_trajectory
+from modules.scan_executor import SpectraRing, StepScanner
 
 # Graph settings
 plt.rcParams['font.family'] ='sans-serif'
@@ -63,6 +61,7 @@ if __name__ == "__main__":
     depth_max=0.3 #maximum value of depth axis[mm]
     use_um=True #whether to use [μm]　units or not
     averaging=1 #The number of measurement repetitions. used in 2d/3d measurement.
+    serpentine=True #Whether the odd rows of 3d measurement are measured in the reverse direction (no flyback)
     step_h=2000 # Number of horizontal divisions
     width=15 # Horizontal scanning width[mm]
     step_v=10 # Number of vertical divisions
@@ -114,7 +113,7 @@ if __name__ == "__main__":
             print('Stage position data loaded.')
             stage_s.biaxial_move(v=vi, vmode='a', h=hi, hmode='a')
 
-    sp = Processor(ccs.wavelength[ccs_st:ccs_ed], n=1.5,depth_max=depth_max,resolution=resolution)
+    sp = Processor(ccs.wavelength[ccs_st:ccs_ed], n=1.5,depth_max=depth_max,resolution=resolution,fused=True)
     q = Queue()
     proc1 = Process(target=profile_beam, args=(q,))  # Beam profiler
     proc1.start()
@@ -135,6 +134,16 @@ if __name__ == "__main__":
     location=np.zeros(3,dtype=int) 
     x, y, z = 100000, 0, 0  # Stage position (Initial)
 
+    # Scan positions [pulse]. The spectra are read by acquisition threads while the stage moves to the next point.
+    h_points=int((width*pl_rate/2)+hi)+np.arange(step_h)*int(width/step_h*pl_rate*(-1))
+    v_points=int(height*pl_rate/2)+vi+np.arange(step_v)*int(height/step_v*pl_rate*(-1))
+    if stage_s_flag:
+        ccs_ring=SpectraRing(ccs.read_frame,ccs.wavelength.size,averaging=averaging,continuous=True,into=True)
+        pma_ring=SpectraRing(lambda:pma.read_spectra(averaging=averaging),pma.wavelength.size)
+        oct_scanner=StepScanner(stage_s,[ccs_ring])
+        abs_scanner=StepScanner(stage_s,[pma_ring])
+        dual_scanner=StepScanner(stage_s,[pma_ring,ccs_ring])  # Both spectrometers are read at the same time
+
     # Graph initialization
     fig = plt.figure(figsize=(10, 10), dpi=80, tight_layout=True)
     fig.canvas.mpl_connect('key_press_event', lambda event:on_key(event,q))  # Key event
@@ -185,7 +194,7 @@ if __name__ == "__main__":
     # Main loop
     while g_key != 'escape':  # ESC key to exit
         # Spectral measurement (CCS)
-        try: itf[0,:] = ccs.read_spectra(averaging=5)
+        try: ccs.read_spectra(averaging=5,out=itf[0])
         except CcsError as ccs_e:
             ccs_err = True
             print(ccs_e, end="\r")
@@ -254,10 +263,10 @@ if __name__ == "__main__":
                     print("Error:No reference data available.")
             else:
                 print("OCT:Measurement(2D) start")
-                stage_s.absolute_move(int((width*pl_rate/2)+hi))
-                for i in tqdm(range(step_h)):
-                    itf[i,:]=ccs.read_spectra(averaging)
-                    stage_s.relative_move(int(width/step_h*pl_rate*(-1)))
+                stage_s.latency.reset()
+                with tqdm(total=step_h) as bar:
+                    oct_scanner.scan(scan_trajectory.line(h_points),[itf],progress=bar.update)
+                stage_s.latency.dump()
                 stage_s.move_origin(axis_num=1,ret_form=1)
                 result_map=sp.generate_bscan(itf[:,ccs_st:ccs_ed], reference[ccs_st:ccs_ed])
                 plt.figure()
@@ -280,12 +289,10 @@ if __name__ == "__main__":
                 print('OCT:Measurement(3D) start')
                 itf_3d=np.zeros((step_v,step_h,ccs.wavelength.size),dtype=float)
                 result_map=np.zeros((step_v,step_h,resolution))
-                stage_s.biaxial_move(v=int(height*pl_rate/2)+vi, vmode='a', h=int((width*pl_rate/2))+hi, hmode='a')
-                for i in tqdm(range(step_v)):
-                    for j in range(step_h):
-                        itf_3d[i][j]=ccs.read_spectra(averaging)
-                        stage_s.relative_move(int(width/step_h*pl_rate*(-1)))
-                    stage_s.biaxial_move(v=int(height/step_v*pl_rate*(-1)), vmode='r', h=int((width*pl_rate/2)), hmode='a')
+                stage_s.latency.reset()
+                with tqdm(total=step_v*step_h) as bar:
+                    oct_scanner.scan(scan_trajectory.raster(h_points,v_points,serpentine),[itf_3d],progress=bar.update)
+                stage_s.latency.dump()
                 dh.save_spectra_3d(wavelength=ccs.wavelength,width=width,height=height,reference=reference,spectra=itf_3d,memo=memo)
 
         #'t' key to delete reference and a-scan data       
@@ -321,10 +328,10 @@ if __name__ == "__main__":
                     print('Error:Incident light data not found.')
             else:
                 print('ABS:Measurement(2D) start')
-                stage_s.absolute_move(int((width*pl_rate/2)+hi))
-                for i in tqdm(range(step_h)):
-                    reflect[i,:]=pma.read_spectra(averaging=averaging)
-                    stage_s.relative_move(int(width/step_h*pl_rate*(-1)))
+                stage_s.latency.reset()
+                with tqdm(total=step_h) as bar:
+                    abs_scanner.scan(scan_trajectory.line(h_points),[reflect],progress=bar.update)
+                stage_s.latency.dump()
                 stage_s.move_origin(axis_num=1,ret_form=1)
 
                 #save data
@@ -353,14 +360,21 @@ if __name__ == "__main__":
                     print('Error:Incident light data not found.')
             else:
                 print('ABS:Measurement(3D) start')
-                reflect_3d=np.zeros((step_v,step_h,pma.wavelength),dtype=float)
-                stage_s.biaxial_move(v=int(height*pl_rate/2)+vi, vmode='a', h=int((width*pl_rate/2))+hi, hmode='a')
-                for i in tqdm (range(step_v)):
-                    for j in range(step_h):
-                        reflect_3d[i][j]=pma.read_spectra(averaging=averaging)
-                        stage_s.relative_move(int(width/step_h*pl_rate*(-1)))
-                    stage_s.biaxial_move(v=int(height/step_v*pl_rate*(-1)), vmode='r', h=int((width*pl_rate/2)), hmode='a')
-                dh.save_spectra_3d(wavelength=pma.wavelength,width=width,height=height,reference=inc,spectra=reflect,memo=memo+'Attention:This is absorbance measurement data.')
+                reflect_3d=np.zeros((step_v,step_h,pma.wavelength.size),dtype=float)
+                stage_s.latency.reset()
+                with tqdm(total=step_v*step_h) as bar:
+                    abs_scanner.scan(scan_trajectory.raster(h_points,v_points,serpentine),[reflect_3d],progress=bar.update)
+                stage_s.latency.dump()
+                dh.save_spectra_3d(wavelength=pma.wavelength,width=width,height=height,reference=inc,spectra=reflect_3d,memo=memo+'Attention:This is absorbance measurement data.')
+
+                #signal processing and plot (mean absorbance in the wavelength range)
+                result_map=np.nanmean(sp.calculate_absorbance(reflect_3d[:,:,pma_st:pma_ed]),axis=-1)
+                plt.figure()
+                plt.imshow(result_map,cmap='jet',extent=[0,width,0,height])
+                plt.colorbar()
+                plt.xlabel('Width [mm]')
+                plt.ylabel('Height [mm]')
+                plt.show()
 
         # 'g' key to delete incident light data
         if g_key == 'g':
@@ -413,15 +427,14 @@ if __name__ == "__main__":
                 print('OCT & ABS:Measurement(2D) start')
 
                 #measurement loop
-                stage_s.absolute_move(int((width*pl_rate/2)+hi))
-                for i in tqdm(range(step_h)):
-                    reflect[i,:]=pma.read_spectra(averaging=averaging)
-                    itf[i,:]=ccs.read_spectra(averaging)
-                    stage_s.relative_move(int(width/step_h*pl_rate*(-1)))
+                stage_s.latency.reset()
+                with tqdm(total=step_h) as bar:
+                    dual_scanner.scan(scan_trajectory.line(h_points),[reflect,itf],progress=bar.update)
+                stage_s.latency.dump()
                 stage_s.biaxial_move(v=vi, vmode='a', h=hi, hmode='a')
 
                 #signal processing
-                result_abs=sp.calculate_absorbance_2d(reflection=reflect)
+                result_abs=sp.calculate_absorbance_2d(reflection=reflect[:,pma_st:pma_ed])
                 result_oct=sp.generate_bscan(itf[:,ccs_st:ccs_ed],reference[ccs_st:ccs_ed])
 
                 #save data
@@ -450,20 +463,26 @@ if __name__ == "__main__":
                 print('ABS:Measurement(3D) start')
 
                 #measurement loop
-                reflect_3d=np.zeros((step_v,step_h,pma.wavelength),dtype=float)
+                reflect_3d=np.zeros((step_v,step_h,pma.wavelength.size),dtype=float)
                 itf_3d=np.zeros((step_v,step_h,ccs.wavelength.size),dtype=float)
-                stage_s.biaxial_move(v=int(height*pl_rate/2)+vi, vmode='a', h=int((width*pl_rate/2))+hi, hmode='a')
-                for i in tqdm (range(step_v)):
-                    for j in range(step_h):
-                        reflect_3d[i][j]=pma.read_spectra(averaging=averaging)
-                        itf_3d[i][j]=ccs.read_spectra(averaging)
-                        stage_s.relative_move(int(width/step_h*pl_rate*(-1)))
-                    stage_s.biaxial_move(v=int(height/step_v*pl_rate*(-1)), vmode='r', h=int((width*pl_rate/2)), hmode='a')
+                stage_s.latency.reset()
+                with tqdm(total=step_v*step_h) as bar:
+                    dual_scanner.scan(scan_trajectory.raster(h_points,v_points,serpentine),[reflect_3d,itf_3d],progress=bar.update)
+                stage_s.latency.dump()
                 stage_s.biaxial_move(v=vi, vmode='a', h=hi, hmode='a')
 
                 #save data
                 dh.save_spectra_3d(wavelength=ccs.wavelength,width=width,height=height,reference=reference,spectra=itf_3d,memo=memo)
-                dh.save_spectra_3d(wavelength=pma.wavelength,width=width,height=height,reference=inc,spectra=reflect,memo=memo+'Attention:This is absorbance measurement data.')
+                dh.save_spectra_3d(wavelength=pma.wavelength,width=width,height=height,reference=inc,spectra=reflect_3d,memo=memo+'Attention:This is absorbance measurement data.')
+
+                #absorbance map (mean absorbance in the wavelength range)
+                result_map=np.nanmean(sp.calculate_absorbance(reflect_3d[:,:,pma_st:pma_ed]),axis=-1)
+                plt.figure()
+                plt.imshow(result_map,cmap='jet',extent=[0,width,0,height])
+                plt.colorbar()
+                plt.xlabel('Width [mm]')
+                plt.ylabel('Height [mm]')
+                plt.show()
         
         # 'b'key to delete reference data and incident light data
         if g_key =='b':
@@ -484,8 +503,8 @@ if __name__ == "__main__":
                 stage_s.biaxial_move(v=vi, vmode='a', h=hi, hmode='a')
             elif g_key=='2':stage_s.relative_move(2000,axis_num=2,velocity=9) #down
             elif g_key=='8':stage_s.relative_move(-2000,axis_num=2,velocity=9) #up
-            location[0]=stage_s.read_position(axis_num=1)
-            location[1]=stage_s.read_position(axis_num=2)
+            location[0]=stage_s.position(1)
+            location[1]=stage_s.position(2)
             print('Stage position:x={}[mm],y={}[mm],z={}[nm]'.format((location[0]-hi)/pl_rate,(location[1]-vi)/pl_rate,location[2]/pl_rate))
         
         #'/' key to move the stage to the left edge (for when change sample)
@@ -6,14 +6,12 @@ import cv2
 import matplotlib.pyplot as plt
 from matplotlib.ticker import ScalarFormatter
 from tqdm import tqdm
-from modules.pma12 import Pma12, PmaError
-from modules.fine01r import Fine01r, Fine01rError
+from modules.devices import Pma12, PmaError, Fine01r, Fine01rError, Crux, CruxError, ArtCam130, Ccs175m, CcsError  # Simulated if OCT_SIMULATE is set
 #from modules.ncm6212c import Ncm6212c, Ncm6212cError
-from modules.crux import Crux,CruxError
-from modules.artcam130mi import ArtCam130
-from modules.signal_processing_hamasaki import SignalProcessorHamasaki as Processor
+from modules.ascan_engine import AscanEngine
+from modules import scan_trajectory
+from modules.scan_executor import SpectraRing, StepScanner, FlyScanner
 import modules.data_handler as dh
-from modules.ccs175m import Ccs175m,CcsError
 
 # Graph settings
 plt.rcParams['font.family'] ='sans-serif'
@@ -27,6 +25,7 @@ plt.rcParams["xtick.minor.width"] = 0.5
 plt.rcParams["ytick.minor.width"] = 0.5
 plt.rcParams['font.size'] = 14
 plt.rcParams['axes.linewidth'] = 1.0
+plt.rcParams['keymap.fullscreen'] = [key for key in plt.rcParams['keymap.fullscreen'] if key != 'f']  # 'f' starts the fly scan
 
 # Globals
 g_key = None  # Pressed key
@@ -69,6 +68,8 @@ if __name__ == "__main__":
     step_v=150 # Number of vertical divisions
     height=0.5 # Vertical scaninng height[mm]
     averaging=20
+    serpentine=True # Whether the odd rows of 3D measurement are measured in the reverse direction (no flyback)
+    fly_velocity=1 # Stage speed of the fly scan ('f' key). At least one spectra must be measured per step.
     memo='thin skin of onion.horizontal way is parallel to the fiber. lens=THORLABS LSM54-850'
 
     #Constants
@@ -105,7 +106,7 @@ if __name__ == "__main__":
             stage_s.biaxial_move(v=vi, vmode='a', h=hi, hmode='a')
     #pma = Pma12(dev_id=5)  # Spectrometer (old)
     ccs=Ccs175m(name='USB0::0x1313::0x8087::M00801544::RAW') #Spectrometer (new)
-    sp = Processor(ccs.wavelength[st:ed], n=1.5,depth_max=depth_max,resolution=resolution)
+    sp = AscanEngine(ccs.wavelength[st:ed], n=1.5,depth_max=depth_max,resolution=resolution,batch=(1,step_h))  # The transforms for the live view and the B-scans are selected by a benchmark (cached)
     q = Queue()
     proc1 = Process(target=profile_beam, args=(q,))  # Beam profiler
     proc1.start()
@@ -120,6 +121,13 @@ if __name__ == "__main__":
     err = False
     location=np.zeros(3,dtype=int)
 
+    # Scan positions [pulse]. The spectra are read by an acquisition thread while the stage moves to the next point.
+    h_points=int((width*pl_rate/2)+hi)+np.arange(step_h)*int(width/step_h*pl_rate*(-1))
+    v_points=int(height*pl_rate/2)+vi+np.arange(step_v)*int(height/step_v*pl_rate*(-1))
+    if stage_s_flag:
+        scanner=StepScanner(stage_s,[SpectraRing(ccs.read_frame,ccs.wavelength.size,averaging=averaging,continuous=True,into=True)])
+        fly_scanner=FlyScanner(stage_s,SpectraRing(ccs.read_frame,ccs.wavelength.size,continuous=True,slots=256,into=True),velocity=fly_velocity)
+
     # Graph initialization
     fig = plt.figure(figsize=(10, 10), dpi=80, tight_layout=True)
     fig.canvas.mpl_connect('key_press_event', lambda event:on_key(event,q))  # Key event
@@ -160,12 +168,12 @@ if __name__ == "__main__":
                     stage_s.biaxial_move(v=vi, vmode='a', h=hi, hmode='a')
             elif g_key=='2':stage_s.relative_move(2000,axis_num=2,velocity=9)
             elif g_key=='8':stage_s.relative_move(-2000,axis_num=2,velocity=9)
-            location[0]=stage_s.read_position(axis_num=1)
-            location[1]=stage_s.read_position(axis_num=2)
+            location[0]=stage_s.position(1)
+            location[1]=stage_s.position(2)
             print('Stage position:x={}[mm],y={}[mm],z={}[nm]'.format((location[0]-hi)/pl_rate,(location[1]-vi)/pl_rate,location[2]/pl_rate))
 
         # Spectral measurement
-        try: itf[0,:] = ccs.read_spectra(averaging=5)
+        try: ccs.read_spectra(averaging=5,out=itf[0])
         except CcsError as e:
             err = True
             print(e, end="\r")
@@ -221,10 +229,10 @@ if __name__ == "__main__":
                 print("Error:No reference data available.")
             else:
                 print("Measurement(2D) start")
-                stage_s.absolute_move(int((width*pl_rate/2)+hi))
-                for i in tqdm(range(step_h)):
-                    itf[i,:]=ccs.read_spectra(averaging)
-                    stage_s.relative_move(int(width/step_h*pl_rate*(-1)))
+                stage_s.latency.reset()
+                with tqdm(total=step_h) as bar:
+                    scanner.scan(scan_trajectory.line(h_points),[itf],progress=bar.update)
+                stage_s.latency.dump()
                 result_map=sp.generate_bscan(itf[:,st:ed], ref[st:ed])
                 plt.figure()
                 plt.imshow(result_map,cmap='jet',extent=[0,depth_max,0,width],aspect=(depth_max/width)*(2/3),vmax=0.5)
@@ -240,13 +248,32 @@ if __name__ == "__main__":
             if ref is None:
                 print('Error:No reference data available.')
             else:
-                stage_s.biaxial_move(v=int(height*pl_rate/2)+vi, vmode='a', h=int((width*pl_rate/2))+hi, hmode='a')
-                for i in tqdm(range(step_v)):
-                    for j in range(step_h):
-                        itf_3d[i][j]=ccs.read_spectra(averaging)
-                        stage_s.relative_move(int(width/step_h*pl_rate*(-1)))
-                    stage_s.biaxial_move(v=int(height/step_v*pl_rate*(-1)), vmode='r', h=int((width*pl_rate/2)), hmode='a')
+                stage_s.latency.reset()
+                with tqdm(total=step_v*step_h) as bar:
+                    scanner.scan(scan_trajectory.raster(h_points,v_points,serpentine),[itf_3d],progress=bar.update)
+                stage_s.latency.dump()
                 dh.save_spectra_3d(wavelength=ccs.wavelength,width=width,height=height,reference=ref,spectra=itf_3d,memo=memo)
+        # 'f' key to start measurement (2-dimention data) with the stage moving continuously (fly scan)
+        elif g_key == 'f' and stage_s_flag:
+            if ref is None:
+                print("Error:No reference data available.")
+            else:
+                print("Measurement(2D, fly scan) start")
+                start=time.perf_counter()
+                stage_s.latency.reset()
+                frames=fly_scanner.scan(h_points,itf)
+                print('{} spectra were measured in {:.2f} sec.'.format(frames,time.perf_counter()-start))
+                stage_s.latency.dump()
+                result_map=sp.generate_bscan(itf[:,st:ed], ref[st:ed])
+                plt.figure()
+                plt.imshow(result_map,cmap='jet',extent=[0,depth_max,0,width],aspect=(depth_max/width)*(2/3),vmax=0.5)
+                plt.colorbar()
+                plt.xlabel('depth[mm]')
+                plt.ylabel('width[mm]')
+                # Save data
+                dh.save_spectra(wavelength=ccs.wavelength, reference=ref, spectra=itf.T, memo=memo+' (fly scan)')
+                stage_s.move_origin(axis_num=1,ret_form=1)
+                plt.show()
 
         # 'p' key to check measurement range of 2d measurement
         # Set the light source to He-Ne laser and check if the light hits the target range of the measurement.